@@ -79,7 +79,8 @@ fixtures = [
 # ------------
 
 # before_install = "weclapp_migration.install.before_install"
-# after_install = "weclapp_migration.install.after_install"
+after_install = "weclapp_migration.install.after_install"
+after_migrate = "weclapp_migration.install.after_migrate"
 
 # Uninstallation
 # ------------
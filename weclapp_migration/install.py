@@ -0,0 +1,35 @@
+import frappe
+
+WC_ID_INDEX = "wc_id_index"
+
+def after_install():
+    ensure_wc_id_indexes()
+
+def after_migrate():
+    ensure_wc_id_indexes()
+
+def get_wc_id_doctypes() -> list[str]:
+    """Gets the DocTypes with a wc_id custom field, i.e. the target DocTypes of the migration."""
+    return frappe.get_all("Custom Field", filters={"fieldname": "wc_id"}, pluck="dt", order_by="dt")
+
+def get_missing_wc_id_indexes() -> list[str]:
+    """Gets the DocTypes whose wc_id column has no database index."""
+    return [doctype for doctype in get_wc_id_doctypes()
+            if frappe.db.has_column(doctype, "wc_id") and not has_wc_id_index(doctype)]
+
+def has_wc_id_index(doctype: str) -> bool:
+    # Indexes created for search_index are named after the field
+    return frappe.db.has_index(f"tab{doctype}", "wc_id") or frappe.db.has_index(f"tab{doctype}", WC_ID_INDEX)
+
+def ensure_wc_id_indexes() -> list[str]:
+    """Adds a database index on wc_id to every target DocType that lacks one.
+
+    Returns:
+        list: DocTypes the index was added to
+    """
+    missing = get_missing_wc_id_indexes()
+    for doctype in missing:
+        frappe.db.add_index(doctype, ["wc_id"], WC_ID_INDEX)
+    if missing:
+        print(f"Added wc_id index to: {', '.join(missing)}")
+    return missing
@@ -3,6 +3,9 @@ from .migration import Migration
 from ..tools.data import get_country_by_code, standardize_phone_number
 
 class AddressMigration(Migration):
+    wc_properties = ["id", "city", "countryCode", "deliveryAddress", "primeAddress", "invoiceAddress",
+                     "phoneNumber", "state", "street1", "street2", "zipcode"]
+
     @property
     def wc_doctype(self) -> str:
         return None
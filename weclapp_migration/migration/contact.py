@@ -5,6 +5,10 @@ from ..tools.data import standardize_phone_number, get_salutation, prepare_email
 import re
 
 class ContactMigration(Migration):
+    wc_properties = ["id", "salutation", "title", "firstName", "lastName", "email",
+                     "phone", "fax", "mobilePhone1", "mobilePhone2"]
+    wc_nested = {"addresses": AddressMigration}
+
     @property
     def wc_doctype(self) -> str:
         return None
@@ -32,7 +36,6 @@ class ContactMigration(Migration):
         en_doc.update({
             "address": None
         }).save()
-        frappe.db.commit()
         en_doc.reload()
         en_doc._validate()
         self._delete_linked_childs(AddressMigration(self.api, parent_doc=en_doc), en_doc)
@@ -1,12 +1,28 @@
 import frappe
 from .migration import Migration
+from ..weclapp.query import Eq
 from ..tools.data import standardize_phone_number, remove_html_tags, get_salutation, prepare_email
 from .contact import ContactMigration
 from .address import AddressMigration
+from .salutation import SalutationMigration
+from .user import UserMigration
+from .industry_type import IndustryTypeMigration
+from .market_segment import MarketSegmentMigration
+from .lead_source import LeadSourceMigration
 
 class CustomerMigration(Migration):
     """Migrates customers from WeClapp to ERPNext"""
 
+    wc_properties = ["id", "customerNumber", "salutation", "title", "partyType", "company", "firstName",
+                     "lastName", "website", "vatRegistrationNumber", "phone", "email", "sectorName",
+                     "customerCategoryName", "customerRatingName", "leadSourceName", "description",
+                     "responsibleUserUsername", "customerTopics", "primaryContactId", "primaryAddressId"]
+    wc_nested = {"contacts": ContactMigration, "addresses": AddressMigration}
+    wc_related_properties = {"party": ["id", "customerNumber", "customerInternalNote"]}
+    numbered_names = True
+    clearable = True
+    depends_on = [SalutationMigration, UserMigration, IndustryTypeMigration, MarketSegmentMigration, LeadSourceMigration]
+
     @property
     def wc_doctype(self) -> str:
         return "customer"
@@ -51,7 +67,6 @@ class CustomerMigration(Migration):
             "customer_primary_contact": None,
             "customer_primary_address": None
         }).save()
-        frappe.db.commit()
         en_doc.reload()
         self._delete_linked_childs(ContactMigration(self.api, parent_doc=en_doc), en_doc)
         self._delete_linked_childs(AddressMigration(self.api, parent_doc=en_doc), en_doc)
@@ -101,7 +116,8 @@ class CustomerMigration(Migration):
         if wc_obj.get("description", None):
             details += wc_obj.get('description', None)
         # Notes
-        parties = self.api.get_cache_objects("party", query=lambda x: x["customerNumber"] == wc_obj["customerNumber"])
+        parties = self.api.get_cache_objects("party", Eq("customerNumber", wc_obj["customerNumber"]),
+                                              self.wc_related_properties["party"])
         for party in parties:
             if party.get("customerInternalNote", None):
                 if len(details) > 0:
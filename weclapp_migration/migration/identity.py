@@ -0,0 +1,66 @@
+import frappe
+
+class IdentityMap:
+    """Maps WeClapp-IDs to the names of the migrated ERPNext documents of a DocType.
+    Loaded with one query per run and kept up to date by the migrations,
+    so existence checks and name lookups don't query the database.
+    Also holds the content hash of every migrated document (see Migration.get_hash)."""
+
+    def __init__(self, doctype: str):
+        self.doctype = doctype
+        self.names = {}
+        self.wc_ids = {}
+        self.hashes = {}
+        self.load()
+
+    def load(self):
+        """Loads the WeClapp-IDs of all migrated documents.
+        DocTypes without the wc_id field have an empty map, without the wc_hash field no hashes.
+        Database errors are raised: an empty map would make every migrated document look new."""
+        self.names, self.wc_ids, self.hashes = {}, {}, {}
+        if not frappe.db.table_exists(self.doctype) or not frappe.db.has_column(self.doctype, "wc_id"):
+            return
+        fields = ["name", "wc_id", "wc_hash"] if frappe.db.has_column(self.doctype, "wc_hash") else ["name", "wc_id"]
+        rows = frappe.get_all(self.doctype,
+                              fields=fields,
+                              filters={"wc_id": ["is", "set"]},
+                              limit_page_length=0)
+        for row in rows:
+            self.add(row.wc_id, row.name, row.get("wc_hash", None))
+
+    def get(self, wc_id: str) -> str:
+        """Gets the name of the document with the given WeClapp-ID (None if it isn't migrated)."""
+        return self.names.get(str(wc_id), None) if wc_id else None
+
+    def get_hash(self, wc_id: str) -> str:
+        """Gets the content hash stored with the document of the given WeClapp-ID (None if there is none)."""
+        return self.hashes.get(str(wc_id), None) if wc_id else None
+
+    def add(self, wc_id: str, name: str, wc_hash: str = None):
+        if wc_id:
+            self.names[str(wc_id)] = name
+            self.wc_ids[name] = str(wc_id)
+            self.set_hash(wc_id, wc_hash)
+
+    def set_hash(self, wc_id: str, wc_hash: str) -> str:
+        """Sets the content hash of the document with the given WeClapp-ID.
+
+        Returns:
+            str: Previous hash
+        """
+        previous = self.hashes.pop(str(wc_id), None)
+        if wc_hash:
+            self.hashes[str(wc_id)] = wc_hash
+        return previous
+
+    def remove(self, name: str) -> str:
+        """Removes the document with the given name, e.g. after it was deleted.
+
+        Returns:
+            str: WeClapp-ID of the removed document
+        """
+        wc_id = self.wc_ids.pop(name, None)
+        if wc_id is not None:
+            self.names.pop(wc_id, None)
+            self.hashes.pop(wc_id, None)
+        return wc_id
@@ -4,6 +4,9 @@ from .migration import Migration
 class IndustryTypeMigration(Migration):
     """Base class for all migrations"""
 
+    wc_properties = ["id", "name"]
+    bulk = True
+
     @property
     def wc_doctype(self) -> str:
         return "sector"
@@ -1,7 +1,11 @@
 import frappe
 from .migration import Migration
+from .uom import UomMigration
 
 class ItemMigration(Migration):
+    wc_properties = ["id", "articleNumber", "name", "unitName", "description", "articlePrices"]
+    depends_on = [UomMigration]
+
     @property
     def wc_doctype(self) -> str:
         return "article"
@@ -1,10 +1,26 @@
 import frappe
 from .migration import Migration
+from ..weclapp.query import Eq
 from .contact import ContactMigration
 from .address import AddressMigration
+from .salutation import SalutationMigration
+from .user import UserMigration
+from .industry_type import IndustryTypeMigration
+from .market_segment import MarketSegmentMigration
+from .lead_source import LeadSourceMigration
 from ..tools.data import standardize_phone_number, get_salutation, prepare_email
 
 class LeadMigration(Migration):
+    wc_properties = ["id", "leadNumber", "salutation", "title", "firstName", "lastName", "company",
+                     "leadSourceName", "email", "phone", "website", "sectorName", "customerCategoryName",
+                     "leadStatus", "description", "responsibleUserUsername", "leadTopics",
+                     "primaryContactId", "primaryAddressId"]
+    wc_nested = {"contacts": ContactMigration, "addresses": AddressMigration}
+    wc_related_properties = {"party": ["id", "customerNumber", "customerInternalNote"]}
+    numbered_names = True
+    clearable = True
+    depends_on = [SalutationMigration, UserMigration, IndustryTypeMigration, MarketSegmentMigration, LeadSourceMigration]
+
     @property
     def wc_doctype(self) -> str:
         return "lead"
@@ -118,7 +134,8 @@ class LeadMigration(Migration):
                 "note": wc_obj.get("description", None)
             }))
         # Internal Notes
-        parties = self.api.get_cache_objects("party", query=lambda x: x["customerNumber"] == wc_obj["leadNumber"])
+        parties = self.api.get_cache_objects("party", Eq("customerNumber", wc_obj["leadNumber"]),
+                                              self.wc_related_properties["party"])
         for party in parties:
             if party.get("customerInternalNote", None):
                 notes.append(frappe.get_doc({
@@ -1,14 +1,43 @@
 import frappe
 from abc import ABC, abstractmethod
 from ..weclapp.api import Api
+from .identity import IdentityMap
+from ..tools.data import get_content_hash
+from ..tools.transaction import TransactionLostError
 from datetime import datetime
 from frappe.exceptions import MandatoryError
 from frappe.utils import file_manager
 from pathlib import Path
+import random
+import time
 
 class Migration(ABC):
     """Base class for all migrations"""
 
+    wc_properties: list[str] = None
+    """WeClapp properties read by the migration. None fetches complete entities."""
+
+    wc_nested: dict[str, type["Migration"]] = {}
+    """Nested WeClapp entities (property -> migration) whose properties are fetched as well"""
+
+    wc_related_properties: dict[str, list[str]] = {}
+    """WeClapp properties of other cached DocTypes read by the migration (DocType -> properties)"""
+
+    depends_on: list[type["Migration"]] = []
+    """Migrations whose documents this migration links to, so they have to run before"""
+
+    numbered_names: bool = False
+    """Documents are named by a WeClapp number (e.g. customerNumber), which can collide.
+    A colliding document is named with its WeClapp-ID as suffix instead of being skipped."""
+
+    clearable: bool = False
+    """Whether "Clear migrated Data" deletes the migrated documents. Off for master data (e.g. UOMs, Users),
+    which ERPNext ships as well and other documents link to."""
+
+    bulk: bool = False
+    """Migrate with multi-row inserts and bulk updates. Only for flat DocTypes without
+    child tables, tags, attachments or controller side effects."""
+
     @property
     @abstractmethod
     def wc_doctype(self) -> str:
@@ -55,66 +84,280 @@ class Migration(ABC):
         self.api = api
         self.parent_doc = parent_doc
 
+    @classmethod
+    def get_wc_properties(cls, prefix: str = None) -> list[str]:
+        """Gets the WeClapp properties read by the migration, including nested entities.
+
+        Args:
+            prefix (str, optional): Property of the parent entity to prefix the properties with. Defaults to None.
+
+        Returns:
+            list: Properties as dotted paths or None if complete entities are needed
+        """
+        if cls.wc_properties is None:
+            return None
+        properties = list(cls.wc_properties)
+        for field, migration in cls.wc_nested.items():
+            nested = migration.get_wc_properties(field)
+            properties += nested if nested is not None else [field]
+        return [f"{prefix}.{p}" for p in properties] if prefix else properties
+
+    def get_wc_projections(self) -> dict[str, list[str]]:
+        """Gets the WeClapp properties to fetch per cached DocType for this migration.
+
+        Returns:
+            dict: DocType -> properties (None for complete entities)
+        """
+        projections = {self.wc_doctype: self.get_wc_properties()} if self.wc_doctype else {}
+        projections.update(self.wc_related_properties)
+        return projections
+
     def migrate(self, query = None, wc_obj = None) -> list["frappe.Document"]:
         """Migrates all entities of the DocType to ERPNext
         
         Args:
-            query (dict, optional): Query to filter the entities. Defaults to None.
+            query (Query, optional): Query to filter the entities (see weclapp.query). Defaults to None.
             wc_obj (dict, optional): Single entity to migrate. Defaults to None.
 
         Returns:
-            list: List of migrated entities
+            list: List of migrated entities (only the inserted ones in bulk mode).
+                Entities whose content hash is unchanged since the last run are skipped.
         """
-        objects = [wc_obj] if wc_obj else self.api.get_cache_objects(self.wc_doctype, query)
-        en_docs = []
-        for obj in objects:
+        objects = [wc_obj] if wc_obj else self.api.get_cache_objects(self.wc_doctype, query, self.get_wc_properties())
+        with self.api.transaction.batch():
+            if self.bulk and not wc_obj:
+                batch_size = self.api.config.wc_bulk_batch_size
+                return self._migrate_units([objects[i:i + batch_size] for i in range(0, len(objects), batch_size)],
+                                           self._migrate_batch)
+            return self._migrate_units(objects, lambda obj: [en_doc for en_doc in [self._migrate_record(obj)] if en_doc])
+
+    def _migrate_units(self, units: list, migrate) -> list["frappe.Document"]:
+        """Migrates the given units (entities or bulk batches) one after another.
+        If the database rolls back the whole transaction (deadlock, lock wait timeout), the units
+        since the last commit are migrated again, up to wc_transaction_retries times.
+
+        Args:
+            units (list): Entities or batches of entities
+            migrate (callable): Migrates a unit and returns the migrated documents
+
+        Returns:
+            list: Migrated documents
+        """
+        en_docs, i, start, kept, attempts = [], 0, 0, 0, 0
+        commits = self.api.transaction.commits
+        while i < len(units):
             try:
-                en_doc = self.get_doc_by_wc_id(obj.get("id", None))
+                en_docs += migrate(units[i])
+            except TransactionLostError as e:
+                attempts += 1
+                # Nested migrations (e.g. contacts) are retried with their parent
+                if self.api.transaction.depth or attempts > self.api.config.wc_transaction_retries:
+                    raise
+                self.api.log("Error", f"Transaction rolled back by the database while migrating {self.en_doctype}, "
+                                      f"migrating the uncommitted entities again", e)
+                del en_docs[kept:]
+                i = start
+                time.sleep(random.uniform(0, attempts))
+                continue
+            i += 1
+            if self.api.transaction.commits != commits:
+                commits, start, kept = self.api.transaction.commits, i, len(en_docs)
+        return en_docs
+
+    def _migrate_record(self, obj: dict) -> "frappe.Document":
+        """Migrates a single entity in its own savepoint. Errors roll back the entity and are logged.
+        Unchanged entities are skipped without touching the database.
+
+        Returns:
+            frappe.Document: Migrated document or None if the migration failed or the entity is unchanged
+        """
+        try:
+            if self.is_unchanged(obj):
+                return None
+            with self.api.transaction.record():
+                name = self.get_name_by_wc_id(obj.get("id", None))
                 obj = self._before_migration(obj)
-                en_doc = self._update(en_doc.name, obj) if en_doc else self._create(obj)
+                en_doc = self._update(name, obj) if name else self._create(obj)
                 self._add_tags(en_doc, obj)
                 self.save_attachments(obj, en_doc)
                 self._after_migration(obj, en_doc)
-                en_docs.append(en_doc)
-            except frappe.exceptions.DuplicateEntryError as e:
-                msg = f"Duplicate entry for {self.en_doctype} with WeClapp-ID {obj.get('id', None)}"
-                print(msg, e, sep="\n")
-                self.api.log("Error", msg, e)
-            except frappe.exceptions.MandatoryError as e:
-                msg = f"Mandatory field missing for {self.en_doctype} with WeClapp-ID {obj.get('id', None)}"
-                print(msg, e, sep="\n")
-                self.api.log("Error", msg, e)
-            except frappe.exceptions.DoesNotExistError as e:
-                msg = f"Child document not found for {self.en_doctype} with WeClapp-ID {obj.get('id', None)}"
-                print(msg, e, sep="\n")
-                self.api.log("Error", msg, e)
-            except frappe.exceptions.ValidationError as e:
-                msg = f"Validation error for {self.en_doctype} with WeClapp-ID {obj.get('id', None)}"
-                print(msg, e, sep="\n")
-                self.api.log("Error", msg, e)
-            except Exception as e:
-                msg = f"Error while migrating {self.en_doctype} with WeClapp-ID {obj.get('id', None)}"
-                print(msg, e, sep="\n")
-                self.api.log("Error", msg, e)
-            # except Exception as e:
-            #     print(f"Error while migrating {self.en_doctype}")
-            #     print(e)
-            #     self.api.log("Error", f"Error while migrating {self.en_doctype}", f"{e}")
-        frappe.db.commit()
-        return en_docs
+                self._store_hash(en_doc, obj)
+                return en_doc
+        except TransactionLostError:
+            raise
+        except frappe.exceptions.DuplicateEntryError as e:
+            msg = f"Duplicate entry for {self.en_doctype} with WeClapp-ID {obj.get('id', None)}"
+            print(msg, e, sep="\n")
+            self.api.log("Error", msg, e)
+        except frappe.exceptions.MandatoryError as e:
+            msg = f"Mandatory field missing for {self.en_doctype} with WeClapp-ID {obj.get('id', None)}"
+            print(msg, e, sep="\n")
+            self.api.log("Error", msg, e)
+        except frappe.exceptions.DoesNotExistError as e:
+            msg = f"Child document not found for {self.en_doctype} with WeClapp-ID {obj.get('id', None)}"
+            print(msg, e, sep="\n")
+            self.api.log("Error", msg, e)
+        except frappe.exceptions.ValidationError as e:
+            msg = f"Validation error for {self.en_doctype} with WeClapp-ID {obj.get('id', None)}"
+            print(msg, e, sep="\n")
+            self.api.log("Error", msg, e)
+        except Exception as e:
+            msg = f"Error while migrating {self.en_doctype} with WeClapp-ID {obj.get('id', None)}"
+            print(msg, e, sep="\n")
+            self.api.log("Error", msg, e)
+        # except Exception as e:
+        #     print(f"Error while migrating {self.en_doctype}")
+        #     print(e)
+        #     self.api.log("Error", f"Error while migrating {self.en_doctype}", f"{e}")
+        return None
+
+    def _migrate_batch(self, batch: list) -> list["frappe.Document"]:
+        """Migrates a batch of entities in bulk: new documents are written with a multi-row insert,
+        existing ones (by WeClapp-ID) with a bulk update. Tags, attachments and controller hooks are skipped.
+        If the batch fails, it is rolled back and migrated record by record.
+
+        Returns:
+            list: Inserted documents
+        """
+        batch = [obj for obj in batch if not self.is_unchanged(obj)]
+        if not batch:
+            return []
+        try:
+            with self.api.transaction.record(len(batch)):
+                return self._write_bulk(batch)
+        except TransactionLostError:
+            raise
+        except Exception as e:
+            self.api.log("Error", f"Bulk migration of {self.en_doctype} failed, migrating the batch record by record", e)
+            return [en_doc for en_doc in (self._migrate_record(obj) for obj in batch) if en_doc]
+
+    def _write_bulk(self, batch: list) -> list["frappe.Document"]:
+        """Writes a batch of entities with one multi-row insert and one bulk update.
+        New entities whose document name exists already (e.g. the standard UOMs of ERPNext)
+        are updated instead, which also sets their WeClapp-ID."""
+        new_docs, updates, hashes = [], {}, {}
+        has_hash = frappe.db.has_column(self.en_doctype, "wc_hash")
+        for obj in batch:
+            obj = self._before_migration(obj)
+            en_obj = self._get_en_obj(obj)
+            name = self.get_name_by_wc_id(obj.get("id", None))
+            if has_hash:
+                en_obj["wc_hash"] = hashes[obj.get("id", None)] = self.get_hash(obj, name)
+            if name:
+                en_obj.pop("name", None)
+                updates[name] = en_obj
+                continue
+            en_doc = frappe.new_doc(self.en_doctype)
+            en_doc.update(en_obj)
+            en_doc.set_new_name()
+            en_doc.owner = en_doc.modified_by = frappe.session.user
+            en_doc.creation = en_doc.modified = frappe.utils.now()
+            new_docs.append((obj.get("id", None), en_obj, en_doc))
+        # One query for the names of the whole batch
+        existing = set(frappe.get_all(self.en_doctype,
+                                      filters={"name": ["in", [en_doc.name for _, _, en_doc in new_docs]]},
+                                      pluck="name")) if new_docs else set()
+        for wc_id, en_obj, en_doc in new_docs:
+            if en_doc.name in existing:
+                en_obj.pop("name", None)
+                updates[en_doc.name] = en_obj
+                self._remember(wc_id, en_doc.name)
+        new_docs = [(wc_id, en_doc) for wc_id, _, en_doc in new_docs if en_doc.name not in existing]
+        if new_docs:
+            rows = [en_doc.get_valid_dict(convert_dates_to_str=True) for _, en_doc in new_docs]
+            fields = list(rows[0])
+            frappe.db.bulk_insert(self.en_doctype, fields, [[row.get(field, None) for field in fields] for row in rows])
+        if updates:
+            frappe.db.bulk_update(self.en_doctype, updates)
+        for wc_id, en_doc in new_docs:
+            self._remember(wc_id, en_doc.name)
+        for wc_id, wc_hash in hashes.items():
+            self._remember_hash(wc_id, wc_hash)
+        return [en_doc for _, en_doc in new_docs]
     
     def clear_migrated(self, en_doc: "frappe.Document" = None):
         """Clears all migrated entities of the DocType from ERPNext"""
         docs = [en_doc] if en_doc else frappe.get_all(self.en_doctype, filters={"wc_id": ["!=", None]})
-        for doc in docs:
-            #try:
-            doc = frappe.get_doc(self.en_doctype, doc.name)
-            self._before_clear_migrated(doc)
-            frappe.delete_doc(self.en_doctype, doc.name)
-            #except Exception as e:
-            #    self.api.log("Error", f"Error while clearing {self.en_doctype}", f"{e}")
-        frappe.db.commit()
+        with self.api.transaction.batch():
+            for doc in docs:
+                #try:
+                with self.api.transaction.record():
+                    doc = frappe.get_doc(self.en_doctype, doc.name)
+                    self._before_clear_migrated(doc)
+                    frappe.delete_doc(self.en_doctype, doc.name)
+                    self._forget(doc.name)
+                #except Exception as e:
+                #    self.api.log("Error", f"Error while clearing {self.en_doctype}", f"{e}")
     
+    def get_hash(self, wc_obj: dict, name: str = None) -> str:
+        """Gets the content hash of the entity as it is migrated: the mapped ERPNext entity, its tags,
+        attachments and the hashes of its nested entities. The WeClapp entity itself is included
+        for properties only read after the mapping (e.g. the primary contact).
+
+        Args:
+            wc_obj (dict): WeClapp entity (prepared by _before_migration)
+            name (str, optional): Name of the ERPNext document, used as parent of the nested entities. Defaults to None.
+
+        Returns:
+            str: Content hash
+        """
+        # Nested migrations only need the DocType and name of their parent
+        parent = frappe._dict(doctype=self.en_doctype, name=name)
+        nested = {}
+        for field, migration in self.wc_nested.items():
+            child_migration = migration(self.api, parent_doc=parent)
+            nested[field] = [child_migration.get_hash(child, child_migration.get_name_by_wc_id(child.get("id", None)))
+                             for child in wc_obj.get(field, None) or list()]
+        files = sorted(Path(file).name for file in self.api.get_cache_documents(self.wc_doctype, wc_obj.get("id", None)))
+        return get_content_hash({
+            "wc": wc_obj,
+            "en": self._get_en_obj(wc_obj),
+            "tags": self._get_tags(wc_obj),
+            "files": files,
+            "nested": nested
+        })
+
+    def is_unchanged(self, wc_obj: dict) -> bool:
+        """Checks if the entity is migrated already and unchanged since, by its stored content hash.
+
+        Args:
+            wc_obj (dict): WeClapp entity
+
+        Returns:
+            bool: True if the entity can be skipped
+        """
+        wc_id = wc_obj.get("id", None)
+        name = self.get_name_by_wc_id(wc_id)
+        wc_hash = self.get_identity_map().get_hash(wc_id)
+        return bool(name and wc_hash) and self.get_hash(self._before_migration(wc_obj), name) == wc_hash
+
+    def _store_hash(self, en_doc: "frappe.Document", wc_obj: dict):
+        """Stores the content hash of the migrated entity on its document (if the DocType has the wc_hash field).
+        If a nested entity failed, the hash is cleared instead, so the entity isn't skipped in the next run
+        and the nested entity is tried again (e.g. after a missing link target was added)."""
+        if not frappe.db.has_column(self.en_doctype, "wc_hash"):
+            return
+        # Set on the document as well, so later saves of it don't write back the old hash
+        wc_hash = self.get_hash(wc_obj, en_doc.name) if self._is_nested_migrated(wc_obj) else None
+        en_doc.db_set("wc_hash", wc_hash, update_modified=False)
+        self._remember_hash(wc_obj.get("id", None), wc_hash)
+
+    def _is_nested_migrated(self, wc_obj: dict) -> bool:
+        """Checks if all nested entities of the entity are migrated completely.
+        A nested entity is complete if it has a stored content hash, or, for DocTypes without
+        the wc_hash field, if it exists and its own nested entities are complete."""
+        for field, migration in self.wc_nested.items():
+            child_migration = migration(self.api)
+            identity_map = child_migration.get_identity_map()
+            has_hash = frappe.db.has_column(child_migration.en_doctype, "wc_hash")
+            for child in wc_obj.get(field, None) or list():
+                id = child.get("id", None)
+                if not identity_map.get(id):
+                    return False
+                if not (identity_map.get_hash(id) if has_hash else child_migration._is_nested_migrated(child)):
+                    return False
+        return True
+
     def get_doc_by_wc_id(self, wc_id: str) -> "frappe.Document":
         """Gets the ERPNext document by the WeClapp-ID
 
@@ -124,13 +367,57 @@ class Migration(ABC):
         Returns:
             frappe.Document: ERPNext document
         """
-        if not wc_id:
+        name = self.get_name_by_wc_id(wc_id)
+        if not name:
             return None
         try:
-            query = frappe.get_all(self.en_doctype, filters={"wc_id": wc_id})
-            return frappe.get_doc(self.en_doctype, query[0]) if len(query) > 0 else None
-        except Exception as e:
+            return frappe.get_doc(self.en_doctype, name)
+        except frappe.DoesNotExistError:
+            # Deleted outside of the migration
+            self.get_identity_map().remove(name)
             return None
+
+    def get_name_by_wc_id(self, wc_id: str) -> str:
+        """Gets the name of the ERPNext document by the WeClapp-ID without loading the document
+
+        Args:
+            wc_id (str): WeClapp-ID of the entity
+
+        Returns:
+            str: Name of the ERPNext document or None if the entity isn't migrated
+        """
+        return self.get_identity_map().get(wc_id)
+
+    def get_identity_map(self, en_doctype: str = None) -> IdentityMap:
+        """Gets the identity map (WeClapp-ID -> name) of the given ERPNext-DocType, loading it once per run.
+
+        Args:
+            en_doctype (str, optional): ERPNext-DocType. Defaults to the DocType of the migration.
+        """
+        en_doctype = en_doctype or self.en_doctype
+        if en_doctype not in self.api.identity_maps:
+            self.api.identity_maps[en_doctype] = IdentityMap(en_doctype)
+        return self.api.identity_maps[en_doctype]
+
+    def _remember(self, wc_id: str, name: str):
+        """Adds a migrated document to the identity map. Undone if the record is rolled back."""
+        identity_map = self.get_identity_map()
+        identity_map.add(wc_id, name)
+        self.api.transaction.on_rollback(lambda: identity_map.remove(name))
+
+    def _remember_hash(self, wc_id: str, wc_hash: str):
+        """Sets the content hash of a migrated document in the identity map. Undone if the record is rolled back."""
+        identity_map = self.get_identity_map()
+        previous = identity_map.set_hash(wc_id, wc_hash)
+        self.api.transaction.on_rollback(lambda: identity_map.set_hash(wc_id, previous))
+
+    def _forget(self, name: str):
+        """Removes a deleted document from the identity map. Undone if the record is rolled back."""
+        identity_map = self.get_identity_map()
+        wc_id = identity_map.wc_ids.get(name, None)
+        wc_hash = identity_map.get_hash(wc_id)
+        identity_map.remove(name)
+        self.api.transaction.on_rollback(lambda: identity_map.add(wc_id, name, wc_hash))
     
     def save_attachments(self, wc_obj: dict, en_doc: "frappe.Document"):
         """Saves all attachments of the WeClapp entity to ERPNext
@@ -177,14 +464,33 @@ class Migration(ABC):
 
     def _create(self, wc_obj: dict) -> "frappe.Document":
         """Create a new entity in ERPNext"""
-        return frappe.get_doc({
-            "doctype": self.en_doctype,
-            **self._get_en_obj(wc_obj)
-        }).insert(ignore_permissions=True, ignore_if_duplicate=True)
+        en_obj = self._get_en_obj(wc_obj)
+        if self.numbered_names and en_obj.get("name", None):
+            try:
+                # Isolated, so a collision only rolls back the failed insert
+                with self.api.transaction.record(0):
+                    en_doc = frappe.get_doc({"doctype": self.en_doctype, **en_obj}).insert(ignore_permissions=True)
+            except frappe.exceptions.DuplicateEntryError:
+                en_doc = frappe.get_doc({
+                    "doctype": self.en_doctype,
+                    **en_obj,
+                    "name": f"{en_obj['name']}-{wc_obj.get('id', None)}"
+                }).insert(ignore_permissions=True)
+        else:
+            en_doc = frappe.get_doc({
+                "doctype": self.en_doctype,
+                **en_obj
+            }).insert(ignore_permissions=True, ignore_if_duplicate=True)
+        self._remember(wc_obj.get("id", None), en_doc.name)
+        return en_doc
 
     def _update(self, id, wc_obj: dict) -> "frappe.Document":
-        """Update an existing entity in ERPNext"""
-        return frappe.get_doc(self.en_doctype, id).update(self._get_en_obj(wc_obj)).save()
+        """Update an existing entity in ERPNext.
+        The name is never changed here: a document named with a suffix after a collision would
+        otherwise be saved under the name of the other document."""
+        en_obj = self._get_en_obj(wc_obj)
+        en_obj.pop("name", None)
+        return frappe.get_doc(self.en_doctype, id).update(en_obj).save()
     
     def _migrate_linked_docs(self, migration: "Migration", \
                              en_doc: "frappe.Document", wc_objects: list) -> list["frappe.Document"]:
@@ -220,7 +526,6 @@ class Migration(ABC):
             link = frappe.get_doc("Dynamic Link", link.name)
             child = frappe.get_doc(migration.en_doctype, link.parent)
             link.delete()
-            frappe.db.commit()
             migration.clear_migrated(child)
 
     def _add_tags(self, en_doc: "frappe.Document", wc_obj: dict):
@@ -1,8 +1,21 @@
 import frappe
 from .migration import Migration
+from ..weclapp.query import Eq
+from .customer import CustomerMigration
+from .lead import LeadMigration
+from .contact import ContactMigration
+from .sales_stage import SalesStageMigration
+from .user import UserMigration
 from ..tools.data import get_date_from_weclapp_ts
 
 class OpportunityMigration(Migration):
+    wc_properties = ["id", "opportunityNumber", "customerId", "contactId", "name", "description",
+                     "responsibleUserUsername", "salesStageName", "salesProbability",
+                     "expectedSignatureDate", "revenue", "hotLead"]
+    wc_related_properties = {"customer": ["id"], "lead": ["id"], "contact": ["id"]}
+    clearable = True
+    depends_on = [CustomerMigration, LeadMigration, ContactMigration, SalesStageMigration, UserMigration]
+
     @property
     def wc_doctype(self) -> str:
         return "opportunity"
@@ -26,10 +39,8 @@ class OpportunityMigration(Migration):
         # -Begründung
         party           = self._party(wc_obj)
         contact         = self._contact(wc_obj)
-        try:
-            owner       = frappe.get_doc("User", wc_obj.get("responsibleUserUsername", None))
-        except frappe.exceptions.DoesNotExistError as e:
-            owner       = None
+        owner           = frappe.db.exists("User", wc_obj.get("responsibleUserUsername", None)) \
+            if wc_obj.get("responsibleUserUsername", None) else None
         return {
             "wc_id"                 : wc_obj.get("id", None),
             "name"                  : wc_obj.get("opportunityNumber", None),        # Nummer
@@ -38,7 +49,7 @@ class OpportunityMigration(Migration):
             "contact_person"        : contact.name if contact else None,            # Kontakt
             "custom_title"          : wc_obj.get("name", None),                     # Bezeichnung
             "custom_description"    : wc_obj.get("description", None),              # Beschreibung
-            "opportunity_owner"     : owner.name if owner else None,                # Verantwortlich                       
+            "opportunity_owner"     : owner,                                                # Verantwortlich                       
             "sales_stage"           : wc_obj.get("salesStageName", None),           # Verkaufsphase
             "status"                : self._status(wc_obj),                         # Status / Verkaufsphase
             "probability"           : wc_obj.get("salesProbability", None),         # Wahrscheinlichkeit
@@ -61,28 +72,30 @@ class OpportunityMigration(Migration):
     def _after_migration(self, wc_obj: dict, en_doc: "frappe.Document"):
         pass
 
-    def _party(self, wc_obj: dict) -> "frappe.Document":
+    def _party(self, wc_obj: dict) -> frappe._dict:
+        """Gets the DocType and name of the Customer or Lead of the opportunity from the identity maps."""
         id = wc_obj.get("customerId", None)
         if not id:
             return None
-        customer = next(iter(self.api.get_cache_objects("customer", lambda x: x["id"] == id)), None)
-        customer = next(iter(frappe.get_all("Customer", filters={"wc_id": id})), None) if customer else None
-        lead = next(iter(self.api.get_cache_objects("lead", lambda x: x["id"] == id)), None)
-        lead = next(iter(frappe.get_all("Lead", filters={"wc_id": id})), None) if lead else None
-        return frappe.get_doc("Customer", customer.name) if customer \
-            else frappe.get_doc("Lead", lead.name) if lead \
+        customer = next(iter(self.api.get_cache_objects("customer", Eq("id", id), self.wc_related_properties["customer"])), None)
+        customer = self.get_identity_map("Customer").get(id) if customer else None
+        lead = next(iter(self.api.get_cache_objects("lead", Eq("id", id), self.wc_related_properties["lead"])), None)
+        lead = self.get_identity_map("Lead").get(id) if lead else None
+        return frappe._dict(doctype="Customer", name=customer) if customer \
+            else frappe._dict(doctype="Lead", name=lead) if lead \
             else None
     
-    def _contact(self, wc_obj: dict) -> "frappe.Document":
+    def _contact(self, wc_obj: dict) -> frappe._dict:
+        """Gets the DocType and name of the contact person of the opportunity from the identity map."""
         id = wc_obj.get("contactId", None)
         if not id or id == wc_obj.get("customerId", None):
             return None
-        contact = next(iter(self.api.get_cache_objects("contact", lambda x: x["id"] == id)), None)
+        contact = next(iter(self.api.get_cache_objects("contact", Eq("id", id), self.wc_related_properties["contact"])), None)
         if contact:
-            contact = next(iter(frappe.get_all("Contact", filters={"wc_id": id})), None)
+            contact = self.get_identity_map("Contact").get(id)
             if not contact:
                 frappe.throw(f"Contact with WeClapp-ID {id} not found in ERPNext", frappe.DoesNotExistError)
-            return frappe.get_doc("Contact", contact.name)
+            return frappe._dict(doctype="Contact", name=contact)
         else:
             return None
 
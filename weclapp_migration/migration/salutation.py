@@ -2,6 +2,9 @@ import frappe
 from .migration import Migration
 
 class SalutationMigration(Migration):
+    wc_properties = ["id", "name"]
+    bulk = True
+
     @property
     def wc_doctype(self) -> str:
         return "title"
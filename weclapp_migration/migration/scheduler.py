@@ -0,0 +1,74 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .migration import Migration
+
+class DependencyCycleError(ValueError):
+    """Raised when the dependencies of the selected migrations contain a cycle."""
+    pass
+
+class MigrationScheduler:
+    """Dependency graph (DAG) of the selected migrations, built from their depends_on declarations.
+
+    A dependency on a selected migration has to be finished first. A dependency on a migration
+    that isn't selected itself but is nested in selected ones (e.g. contacts of customers and leads)
+    waits for all of these. Other dependencies are expected to be migrated already.
+    Independent migrations are ready at the same time, so they can run concurrently."""
+
+    def __init__(self, migrations: list[type["Migration"]]):
+        self.migrations = {migration.__name__: migration for migration in migrations}
+        self.dependencies = {name: self._get_dependencies(migration) for name, migration in self.migrations.items()}
+        self.order = self._sort()
+
+    def get_ready(self, done: set[str]) -> list[str]:
+        """Gets the migrations that aren't done but whose dependencies are all done."""
+        return [name for name in self.order
+                if name not in done and self.dependencies[name] <= done]
+
+    def get_order(self) -> list[str]:
+        """Gets the migrations in topological order (dependencies first)."""
+        return list(self.order)
+
+    def get_critical_path(self) -> list[str]:
+        """Gets the longest chain of dependent migrations, which bounds the duration of a run.
+        Of equally long chains the one with the earliest dependencies (in topological order) is taken."""
+        paths = {}
+        for name in self.order:
+            longest = max((paths[dependency] for dependency in self.order if dependency in self.dependencies[name]),
+                          key=len, default=[])
+            paths[name] = [*longest, name]
+        return max(paths.values(), key=len, default=[])
+
+    def _get_dependencies(self, migration: type["Migration"]) -> set[str]:
+        dependencies = set()
+        for dependency in migration.depends_on:
+            if dependency.__name__ in self.migrations:
+                dependencies.add(dependency.__name__)
+            else:
+                dependencies |= {name for name, provider in self.migrations.items()
+                                 if name != migration.__name__ and dependency in self._get_nested(provider)}
+        return dependencies
+
+    @classmethod
+    def _get_nested(cls, migration: type["Migration"]) -> set[type["Migration"]]:
+        """Gets the migrations nested in the given migration (transitively)."""
+        nested = set()
+        for child in migration.wc_nested.values():
+            nested |= {child, *cls._get_nested(child)}
+        return nested
+
+    def _sort(self) -> list[str]:
+        """Sorts the migrations topologically, keeping the selection order among independent ones.
+
+        Raises:
+            DependencyCycleError: The dependencies contain a cycle
+        """
+        order, done = [], set()
+        while len(order) < len(self.migrations):
+            ready = [name for name in self.migrations if name not in done and self.dependencies[name] <= done]
+            if not ready:
+                cycle = ", ".join(name for name in self.migrations if name not in done)
+                raise DependencyCycleError(f"Migration dependencies contain a cycle: {cycle}")
+            order += ready
+            done |= set(ready)
+        return order
@@ -3,6 +3,8 @@ from .migration import Migration
 from ..tools.data import prepare_email
 
 class UserMigration(Migration):
+    wc_properties = ["id", "email", "firstName", "lastName"]
+
     @property
     def wc_doctype(self) -> str:
         return "user"
@@ -0,0 +1,99 @@
+import shutil
+import tempfile
+import types
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from weclapp_migration.weclapp.cache import CacheStore, CacheManifest
+
+try:
+    from weclapp_migration.weclapp.api import Api
+except ImportError:
+    Api = None
+
+class PageError(Exception):
+    pass
+
+@unittest.skipIf(Api is None, "the API client needs frappe and requests")
+class TestCacheCheckpoint(unittest.TestCase):
+    """Runs Api.cache_doctype against the cache store and manifest with fake WeClapp pages."""
+
+    def setUp(self):
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base)
+        self.entities = {str(i): {"id": str(i), "lastModifiedDate": i * 10} for i in range(1, 6)}
+        self.requested = []
+        self.failing = set()
+        self.api = Api.__new__(Api)
+        self.api.config = types.SimpleNamespace(wc_page_size=2, wc_workers=1, wc_page_retries=1,
+                                                wc_skip_document_doctypes=[], wc_mail_doctypes=[])
+        self.api.deadline = None
+        self.api.executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.api.executor.shutdown)
+        self.api.store = CacheStore(f"{base}/cache.sqlite3")
+        self.addCleanup(self.api.store.close)
+        self.api.manifest = CacheManifest(f"{base}/manifest.json")
+        self.api._get_cache_base = lambda: f"{base}/"
+        self.api._get_count = lambda doctype, params=None: len(self._select(params))
+        self.api._get_page = self._get_page
+        self.api._cache_documents = mock.Mock()
+
+    def _select(self, params: dict) -> list:
+        since = (params or {}).get("lastModifiedDate-gt", None)
+        return [obj for obj in self.entities.values() if not since or obj["lastModifiedDate"] > since]
+
+    def _get_page(self, doctype: str, page: int, params: dict = None, properties: list = None) -> list:
+        self.requested.append(page)
+        if page in self.failing:
+            self.failing.remove(page)
+            raise PageError()
+        size = self.api.config.wc_page_size
+        return [dict(obj) for obj in self._select(params)[(page - 1) * size:page * size]]
+
+    def test_resumed_run_skips_finished_pages(self):
+        self.failing = {3}
+        with self.assertRaises(PageError):
+            self.api.cache_doctype("customer", run_id="a")
+        self.assertEqual(self.api.manifest.get("customer")["checkpoint"]["page"], 2)
+        self.requested = []
+        self.api.cache_doctype("customer", run_id="a")
+        self.assertEqual(self.requested, [3])
+        self.assertEqual(self.api.store.count("customer"), 5)
+        state = self.api.manifest.get("customer")
+        self.assertEqual((state["checkpoint"], state["high_water_mark"], state["run"]), (None, 50, "a"))
+
+    def test_resumed_run_skips_finished_phases(self):
+        self.api._cache_documents.side_effect = [PageError(), None]
+        with self.assertRaises(PageError):
+            self.api.cache_doctype("customer", run_id="a")
+        self.assertEqual(self.api.manifest.get("customer")["checkpoint"]["phase"], "documents")
+        self.requested = []
+        self.api.cache_doctype("customer", run_id="a")
+        self.assertEqual(self.requested, [])
+        self.assertEqual(self.api._cache_documents.call_count, 2)
+        self.assertIsNone(self.api.manifest.get("customer")["checkpoint"])
+
+    def test_other_run_starts_from_the_beginning(self):
+        self.failing = {2}
+        with self.assertRaises(PageError):
+            self.api.cache_doctype("customer", run_id="a")
+        self.requested = []
+        self.api.cache_doctype("customer", run_id="b")
+        self.assertEqual(self.requested, [1, 2, 3])
+
+    def test_resumed_delta_run_keeps_changed_ids(self):
+        self.api.cache_doctype("customer", run_id="a")
+        self.entities["2"]["lastModifiedDate"] = 60
+        self.entities["4"]["lastModifiedDate"] = 70
+        self.api._cache_documents.side_effect = [PageError(), None]
+        with self.assertRaises(PageError):
+            self.api.cache_doctype("customer", delta=True, run_id="b")
+        checkpoint = self.api.manifest.get("customer")["checkpoint"]
+        self.assertEqual((checkpoint["since"], checkpoint["changed"]), (50, 2))
+        self.assertEqual(sorted(self.api.store.get_changed("customer")), ["2", "4"])
+        self.requested = []
+        self.api.cache_doctype("customer", delta=True, run_id="b")
+        self.assertEqual(self.requested, [])
+        self.assertEqual(sorted(self.api._cache_documents.call_args.args[1]), ["2", "4"])
+        self.assertEqual(self.api.store.get_changed("customer"), [])
+        self.assertEqual(self.api.manifest.get("customer")["high_water_mark"], 70)
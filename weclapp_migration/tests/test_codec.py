@@ -0,0 +1,62 @@
+import json
+import unittest
+from unittest import mock
+from weclapp_migration.weclapp import codec
+
+RESULT = [
+    {"id": "1", "name": "Müller & Söhne", "tags": [{"name": "a]b"}, {"name": "{c}"}]},
+    {"id": "2", "note": "quote \" and backslash \\ and \\\"", "nested": {"list": [1, 2.5, -3e2, None]}},
+    {"id": "3", "empty": {}, "flags": [True, False], "text": ""},
+]
+
+def chunked(text: str, size: int, as_bytes: bool = True):
+    data = text.encode("utf-8") if as_bytes else text
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+class TestIterArray(unittest.TestCase):
+    def test_decodes_all_elements(self):
+        document = json.dumps({"result": RESULT})
+        self.assertEqual(list(codec.iter_array(chunked(document, 64 * 1024))), RESULT)
+
+    def test_any_chunk_boundary(self):
+        # Chunks of one byte also split multi-byte characters and escape sequences
+        document = json.dumps({"result": RESULT}, ensure_ascii=False, indent=1)
+        for size in (1, 2, 3, 7, 16):
+            self.assertEqual(list(codec.iter_array(chunked(document, size))), RESULT, size)
+            self.assertEqual(list(codec.iter_array(chunked(document, size, as_bytes=False))), RESULT, size)
+
+    def test_scalar_elements(self):
+        document = '{"result": [1, 22, "a,b", null, true, 3.25]}'
+        self.assertEqual(list(codec.iter_array(chunked(document, 1))), [1, 22, "a,b", None, True, 3.25])
+
+    def test_empty_array(self):
+        self.assertEqual(list(codec.iter_array(chunked('{"result": [ ]}', 1))), [])
+
+    def test_key_not_first(self):
+        document = json.dumps({"other": 1, "result": RESULT})
+        self.assertEqual(list(codec.iter_array(chunked(document, 5))), RESULT)
+
+    def test_missing_key(self):
+        self.assertEqual(list(codec.iter_array(chunked('{"other": []}', 3))), [])
+
+    def test_truncated_document(self):
+        document = json.dumps({"result": RESULT})[:-20]
+        with self.assertRaises(ValueError):
+            list(codec.iter_array(chunked(document, 8)))
+
+    def test_elements_are_decoded_with_loads(self):
+        document = json.dumps({"result": RESULT})
+        with mock.patch.object(codec, "loads", wraps=codec.loads) as loads:
+            list(codec.iter_array(chunked(document, 10)))
+        self.assertEqual(loads.call_count, len(RESULT))
+
+class TestCodec(unittest.TestCase):
+    def test_round_trip(self):
+        for obj in RESULT:
+            self.assertEqual(codec.loads(codec.dumps(obj)), obj)
+            self.assertEqual(codec.loads(codec.dumps(obj).encode("utf-8")), obj)
+
+    def test_stdlib_fallback(self):
+        with mock.patch.object(codec, "orjson", None):
+            self.assertEqual(codec.loads(codec.dumps(RESULT)), RESULT)
+            self.assertNotIn(" ", codec.dumps({"a": [1, 2]}))
@@ -0,0 +1,39 @@
+import shutil
+import tempfile
+import unittest
+from weclapp_migration.weclapp import codec
+from weclapp_migration.weclapp.diff import diff_snapshots
+from weclapp_migration.weclapp.snapshot import SnapshotWriter, SnapshotStore
+
+def snapshot(base: str, entities: list) -> SnapshotStore:
+    with SnapshotWriter(base, "lead", chunk_records=2) as writer:
+        for obj in entities:
+            writer.add(obj["id"], codec.dumps(obj))
+    return SnapshotStore(base)
+
+class TestDiff(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base)
+
+    def test_added_changed_removed(self):
+        old = snapshot(f"{self.base}/old", [{"id": "1", "name": "A"}, {"id": "2", "name": "B"}, {"id": "3", "name": "C"}])
+        new = snapshot(f"{self.base}/new", [{"id": "1", "name": "A"}, {"id": "2", "name": "B2"}, {"id": "4", "name": "D"}])
+        diff = diff_snapshots(old, new, "lead")
+        self.assertEqual(diff.added, {"4"})
+        self.assertEqual(diff.changed, {"2"})
+        self.assertEqual(diff.removed, {"3"})
+        self.assertEqual(diff.get_ids(), {"2", "4"})
+        self.assertEqual(repr(diff), "lead: added 1, changed 1, removed 1")
+
+    def test_unchanged(self):
+        entities = [{"id": str(i), "name": str(i)} for i in range(5)]
+        diff = diff_snapshots(snapshot(f"{self.base}/old", entities), snapshot(f"{self.base}/new", entities), "lead")
+        self.assertEqual(diff.get_ids(), set())
+        self.assertEqual(diff.removed, set())
+
+    def test_without_old_snapshot(self):
+        new = snapshot(f"{self.base}/new", [{"id": "1"}, {"id": "2"}])
+        diff = diff_snapshots(None, new, "lead")
+        self.assertEqual(diff.added, {"1", "2"})
+        self.assertEqual(diff.changed | diff.removed, set())
@@ -0,0 +1,77 @@
+import unittest
+from weclapp_migration.weclapp.cache import HashIndex, SortedIndex
+from weclapp_migration.weclapp.query import Query, Eq, In, Range, Shard, Where, as_query, get_shard
+
+OBJECTS = [
+    {"id": "1", "customerNumber": "C1", "amount": 10},
+    {"id": "2", "customerNumber": "C2", "amount": 20},
+    {"id": "3", "customerNumber": "C1", "amount": 30},
+    {"id": "4", "customerNumber": None, "amount": None},
+]
+
+class Indexes:
+    """Indexes over OBJECTS for the given fields, like DocTypeIndexes."""
+
+    def __init__(self, *fields):
+        self.fields = fields
+
+    def hash(self, field):
+        return HashIndex(field, OBJECTS) if field in self.fields else None
+
+    def sorted(self, field):
+        return SortedIndex(field, OBJECTS) if field in self.fields else None
+
+def run(query, indexes):
+    """Evaluates the query like Api.get_cache_objects."""
+    objects, index = query.candidates(indexes)
+    return sorted(obj["id"] for obj in (OBJECTS if objects is None else objects) if query.match(obj)), index
+
+class TestQuery(unittest.TestCase):
+    def test_query_is_abstract(self):
+        self.assertRaises(TypeError, Query)
+
+    def test_eq(self):
+        self.assertEqual(run(Eq("customerNumber", "C1"), Indexes("customerNumber")),
+                         (["1", "3"], "hash index on customerNumber"))
+        self.assertEqual(run(Eq("customerNumber", "C1"), Indexes()), (["1", "3"], None))
+
+    def test_in(self):
+        self.assertEqual(run(In("id", ["2", "4", "9"]), Indexes("id")), (["2", "4"], "hash index on id"))
+
+    def test_range(self):
+        self.assertEqual(run(Range("amount", gt=10, lte=30), Indexes("amount")),
+                         (["2", "3"], "sorted index on amount"))
+        self.assertEqual(run(Range("amount", gte=10, lt=30), Indexes()), (["1", "2"], None))
+        # Entities without a value never match
+        self.assertEqual(run(Range("amount"), Indexes("amount"))[0], ["1", "2", "3"])
+
+    def test_and_uses_smallest_candidates(self):
+        query = Eq("customerNumber", "C1") & Eq("id", "3")
+        self.assertEqual(run(query, Indexes("customerNumber", "id")), (["3"], "hash index on id"))
+        self.assertEqual(run(query, Indexes("customerNumber")), (["3"], "hash index on customerNumber"))
+
+    def test_or_needs_an_index_for_every_part(self):
+        query = Eq("id", "1") | Eq("customerNumber", "C2")
+        self.assertEqual(run(query, Indexes("id", "customerNumber")),
+                         (["1", "2"], "hash index on id | hash index on customerNumber"))
+        self.assertEqual(run(query, Indexes("id")), (["1", "2"], None))
+
+    def test_or_returns_candidates_once(self):
+        objects, _ = (Eq("id", "1") | In("id", ["1", "2"])).candidates(Indexes("id"))
+        self.assertEqual(len(objects), 2)
+
+    def test_shard_partitions_entities(self):
+        shards = 3
+        ids = [id for shard in range(shards) for id in run(Shard("id", shard, shards), Indexes("id"))[0]]
+        self.assertEqual(sorted(ids), ["1", "2", "3", "4"])
+        self.assertEqual(get_shard("1", shards), get_shard("1", shards))
+
+    def test_where_scans(self):
+        self.assertEqual(run(Where(lambda obj: obj["id"] > "2"), Indexes("id")), (["3", "4"], None))
+
+    def test_as_query(self):
+        self.assertIsNone(as_query(None))
+        query = Eq("id", "1")
+        self.assertIs(as_query(query), query)
+        self.assertEqual(run(as_query({"customerNumber": "C1", "amount": 30}), Indexes())[0], ["3"])
+        self.assertEqual(run(as_query(lambda obj: obj["amount"] == 20), Indexes())[0], ["2"])
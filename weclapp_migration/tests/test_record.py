@@ -0,0 +1,40 @@
+import unittest
+from weclapp_migration.weclapp.record import RecordSchema, CompactRecord
+
+ENTITY = {"id": "1", "customerNumber": "C1", "contacts": [{"id": "2", "email": "a@b.de"}], "unused": True}
+
+class TestCompactRecord(unittest.TestCase):
+    def setUp(self):
+        self.schema = RecordSchema.from_properties(["customerNumber", "contacts.id", "contacts.email", "missing"])
+        self.record = self.schema.compact(ENTITY)
+
+    def test_schema_fields(self):
+        self.assertEqual(self.schema.fields, ("id", "customerNumber", "contacts", "missing"))
+
+    def test_read_access(self):
+        self.assertEqual(self.record["id"], "1")
+        self.assertEqual(self.record.get("customerNumber"), "C1")
+        self.assertEqual(self.record["contacts"], ENTITY["contacts"])
+        self.assertIsNone(self.record["missing"])
+        self.assertIsNone(self.record.get("unused"))
+        self.assertEqual(self.record.get("unused", "default"), "default")
+        self.assertRaises(KeyError, lambda: self.record["unused"])
+        self.assertIn("id", self.record)
+        self.assertNotIn("unused", self.record)
+        self.assertEqual(len(self.record), 4)
+
+    def test_dict_views(self):
+        self.assertEqual(list(self.record.keys()), ["id", "customerNumber", "contacts", "missing"])
+        self.assertEqual(list(self.record.values()), ["1", "C1", ENTITY["contacts"], None])
+        self.assertEqual(dict(self.record.items()), dict(self.record))
+        self.assertEqual(dict(self.record),
+                         {"id": "1", "customerNumber": "C1", "contacts": ENTITY["contacts"], "missing": None})
+
+    def test_equals_dict(self):
+        self.assertEqual(self.record, {"id": "1", "customerNumber": "C1", "contacts": ENTITY["contacts"], "missing": None})
+
+    def test_records_share_schema(self):
+        other = self.schema.compact({"id": "2"})
+        self.assertIs(other.schema, self.record.schema)
+        self.assertFalse(hasattr(other, "__dict__"))
+        self.assertIsInstance(other, CompactRecord)
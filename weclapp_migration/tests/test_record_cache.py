@@ -0,0 +1,65 @@
+import shutil
+import tempfile
+import unittest
+from weclapp_migration.weclapp.cache import CacheStore, RecordCache
+from weclapp_migration.weclapp.record import RecordSchema
+
+class TestRecordCache(unittest.TestCase):
+    def setUp(self):
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base)
+        self.store = CacheStore(f"{base}/cache.sqlite3", {"party": ["customerNumber"]})
+        self.addCleanup(self.store.close)
+        self.store.add_many("party", [{"id": str(i), "customerNumber": f"C{i % 2}", "note": "x" * 100} for i in range(4)])
+        self.store.add_many("lead", [{"id": "1"}])
+
+    def test_hits_and_misses(self):
+        records = RecordCache(self.store, 1024 * 1024)
+        self.assertEqual(len(records.get("party")), 4)
+        records.get("party")
+        self.assertEqual((records.hits, records.misses), (1, 1))
+
+    def test_reload_after_write(self):
+        records = RecordCache(self.store, 1024 * 1024)
+        records.get("party")
+        self.store.add_many("party", [{"id": "9", "customerNumber": "C9"}])
+        self.assertEqual(len(records.get("party")), 5)
+        self.assertEqual(records.misses, 2)
+
+    def test_eviction(self):
+        records = RecordCache(self.store, 1024 * 1024)
+        size = records._get_entry("party")["size"]
+        records = RecordCache(self.store, size + 1)
+        records.get("party")
+        records.get("lead")
+        self.assertEqual(records.evictions, 1)
+        self.assertLessEqual(records.size, records.budget)
+
+    def test_doctype_larger_than_budget_is_kept_outside_of_it(self):
+        records = RecordCache(self.store, 1)
+        with self.assertLogs("weclapp_migration.weclapp.cache", "WARNING"):
+            self.assertEqual(len(records.get("party")), 4)
+        index = records.get_index("party", "customerNumber")
+        self.assertIs(records.get_index("party", "customerNumber"), index)
+        self.assertEqual((records.hits, records.misses, records.oversized_loads), (2, 1, 1))
+        self.assertEqual((len(records.entries), records.size), (0, 0))
+        with self.assertLogs("weclapp_migration.weclapp.cache", "WARNING"):
+            records.get("lead")
+        records.get("party")
+        self.assertEqual(records.oversized_loads, 3)
+
+    def test_indexes(self):
+        records = RecordCache(self.store, 1024 * 1024)
+        self.assertEqual(sorted(obj["id"] for obj in records.get_index("party", "customerNumber").get("C1")), ["1", "3"])
+        self.assertEqual([obj["id"] for obj in records.get_sorted_index("party", "id").range(gte="2")], ["2", "3"])
+        indexes = records.get_indexes("party", ["customerNumber"])
+        self.assertIsNotNone(indexes.hash("customerNumber"))
+        self.assertIsNone(indexes.hash("note"))
+
+    def test_compact_records_per_schema(self):
+        records = RecordCache(self.store, 1024 * 1024)
+        schema = RecordSchema.from_properties(["customerNumber"])
+        compact = records.get("party", schema)
+        self.assertEqual(dict(compact[0]), {"id": "0", "customerNumber": "C0"})
+        self.assertIn("note", records.get("party")[0])
+        self.assertEqual(len(records.entries), 2)
@@ -0,0 +1,64 @@
+import unittest
+from weclapp_migration.migration.scheduler import MigrationScheduler, DependencyCycleError
+
+def migration(name: str, depends_on: list = None, nested: dict = None) -> type:
+    """Creates a stand-in for a Migration class with the attributes the scheduler reads."""
+    return type(name, (), {"depends_on": depends_on or [], "wc_nested": nested or {}})
+
+Uom = migration("Uom")
+Item = migration("Item", [Uom])
+User = migration("User")
+Address = migration("Address")
+Contact = migration("Contact", nested={"addresses": Address})
+Customer = migration("Customer", [User], {"contacts": Contact})
+Lead = migration("Lead", [User], {"contacts": Contact})
+Opportunity = migration("Opportunity", [Contact, Item])
+
+class TestMigrationScheduler(unittest.TestCase):
+    def test_order(self):
+        scheduler = MigrationScheduler([Item, Uom, User])
+        self.assertEqual(scheduler.get_order(), ["Uom", "User", "Item"])
+
+    def test_keeps_selection_order_of_independent_migrations(self):
+        self.assertEqual(MigrationScheduler([User, Uom]).get_order(), ["User", "Uom"])
+
+    def test_unselected_dependencies_are_ignored(self):
+        scheduler = MigrationScheduler([Item])
+        self.assertEqual(scheduler.dependencies, {"Item": set()})
+        self.assertEqual(scheduler.get_ready(set()), ["Item"])
+
+    def test_get_ready(self):
+        scheduler = MigrationScheduler([Uom, Item, User, Customer])
+        self.assertEqual(scheduler.get_ready(set()), ["Uom", "User"])
+        self.assertEqual(scheduler.get_ready({"Uom"}), ["User", "Item"])
+        self.assertEqual(scheduler.get_ready({"Uom", "User"}), ["Item", "Customer"])
+        self.assertEqual(scheduler.get_ready({"Uom", "User", "Item", "Customer"}), [])
+
+    def test_nested_dependencies_wait_for_all_providers(self):
+        scheduler = MigrationScheduler([Uom, Item, User, Customer, Lead, Opportunity])
+        self.assertEqual(scheduler.dependencies["Opportunity"], {"Item", "Customer", "Lead"})
+        self.assertEqual(scheduler.get_order()[-1], "Opportunity")
+
+    def test_selected_dependency_is_preferred_over_providers(self):
+        scheduler = MigrationScheduler([Contact, Customer, Opportunity])
+        self.assertEqual(scheduler.dependencies["Opportunity"], {"Contact"})
+
+    def test_nested_migrations_are_found_transitively(self):
+        self.assertEqual(MigrationScheduler._get_nested(Customer), {Contact, Address})
+
+    def test_critical_path(self):
+        scheduler = MigrationScheduler([Uom, User, Customer, Opportunity])
+        self.assertEqual(scheduler.get_critical_path(), ["User", "Customer", "Opportunity"])
+
+    def test_critical_path_ties_follow_the_order(self):
+        scheduler = MigrationScheduler([User, Uom, Item, Customer, Opportunity])
+        self.assertEqual(scheduler.get_critical_path(), ["Uom", "Item", "Opportunity"])
+        self.assertEqual(MigrationScheduler([]).get_critical_path(), [])
+
+    def test_cycle(self):
+        first = migration("First")
+        second = migration("Second", [first])
+        first.depends_on = [second]
+        with self.assertRaises(DependencyCycleError) as context:
+            MigrationScheduler([Uom, first, second])
+        self.assertIn("First, Second", str(context.exception))
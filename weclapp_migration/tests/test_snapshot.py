@@ -0,0 +1,82 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from weclapp_migration.weclapp import codec
+from weclapp_migration.weclapp.snapshot import SnapshotWriter, SnapshotStore, Generations, link_snapshot
+
+ENTITIES = [{"id": str(i), "name": f"Entity {i}", "tags": ["ä", "\n"]} for i in range(7)]
+
+def write(base: str, doctype: str, entities: list, compress: bool = True):
+    with SnapshotWriter(base, doctype, chunk_records=3, compress=compress) as writer:
+        for obj in entities:
+            writer.add(obj["id"], codec.dumps(obj))
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base)
+
+    def test_round_trip(self):
+        for compress in (True, False):
+            write(self.base, "customer", ENTITIES, compress)
+            store = SnapshotStore(self.base)
+            self.assertTrue(store.exists("customer"))
+            self.assertEqual(list(store.get_all("customer")), ENTITIES)
+            self.assertEqual(store.get("customer", "4"), ENTITIES[4])
+            self.assertEqual(store.get("customer", 6), ENTITIES[6])
+            self.assertIsNone(store.get("customer", "99"))
+            self.assertEqual(store.get_ids("customer"), [obj["id"] for obj in ENTITIES])
+            store.close()
+
+    def test_chunks(self):
+        write(self.base, "customer", ENTITIES)
+        self.assertEqual(sorted(path.name for path in Path(self.base, "customer").glob("*.jsonl*")),
+                         ["00000.jsonl.gz", "00001.jsonl.gz", "00002.jsonl.gz"])
+
+    def test_failed_write_keeps_previous_snapshot(self):
+        write(self.base, "customer", ENTITIES[:2])
+        with self.assertRaises(RuntimeError):
+            with SnapshotWriter(self.base, "customer") as writer:
+                writer.add("9", codec.dumps({"id": "9"}))
+                raise RuntimeError()
+        self.assertEqual(list(SnapshotStore(self.base).get_all("customer")), ENTITIES[:2])
+        self.assertFalse(Path(self.base, "customer.part").exists())
+
+    def test_new_snapshot_is_read_after_replace(self):
+        store = SnapshotStore(self.base)
+        write(self.base, "customer", ENTITIES[:2], compress=False)
+        self.assertEqual(store.get("customer", "1"), ENTITIES[1])
+        changed = {"id": "1", "name": "Changed"}
+        write(self.base, "customer", [ENTITIES[0], changed], compress=False)
+        # The index is reloaded when its modification time changes (forced here, independent of the timestamp resolution)
+        store.indexes["customer"] = (0, store.indexes["customer"][1])
+        self.assertEqual(store.get("customer", "1"), changed)
+        store.close()
+
+    def test_missing_doctype(self):
+        store = SnapshotStore(self.base)
+        self.assertFalse(store.exists("lead"))
+        self.assertEqual(list(store.get_all("lead")), [])
+        self.assertIsNone(store.get("lead", "1"))
+
+    def test_link_snapshot(self):
+        write(self.base, "customer", ENTITIES)
+        target = Path(self.base, "generations", "run.part")
+        link_snapshot(self.base, str(target), "customer")
+        self.assertEqual(list(SnapshotStore(target).get_all("customer")), ENTITIES)
+
+class TestGenerations(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base)
+
+    def test_list_and_prune(self):
+        generations = Generations(self.base, 2)
+        for name in ("20260101000000", "20260102000000", "20260103000000", "run.part"):
+            generations.get_path(name).mkdir()
+        self.assertEqual(generations.list(), ["20260101000000", "20260102000000", "20260103000000"])
+        generations.prune()
+        self.assertEqual(generations.list(), ["20260102000000", "20260103000000"])
+        generations.clear_unfinished()
+        self.assertFalse(generations.get_path("run.part").exists())
@@ -0,0 +1,66 @@
+import unittest
+from weclapp_migration.weclapp.throttle import AdaptiveRateLimiter, CircuitBreaker, CircuitOpenError
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+    def test_first_token_is_free(self):
+        limiter = AdaptiveRateLimiter(10.0, 1.0, 50.0)
+        self.assertEqual(limiter.acquire(), 0.0)
+
+    def test_waits_when_bucket_is_empty(self):
+        limiter = AdaptiveRateLimiter(100.0, 1.0, 100.0)
+        limiter.tokens = 0.0
+        self.assertGreater(limiter.acquire(), 0.0)
+
+    def test_throttle_halves_rate_down_to_minimum(self):
+        limiter = AdaptiveRateLimiter(8.0, 3.0, 50.0)
+        limiter.on_throttle()
+        self.assertEqual(limiter.rate, 4.0)
+        limiter.on_throttle()
+        self.assertEqual(limiter.rate, 3.0)
+
+    def test_success_raises_rate_up_to_maximum(self):
+        limiter = AdaptiveRateLimiter(9.9, 1.0, 10.0, increase=5.0)
+        limiter.on_success()
+        self.assertGreater(limiter.rate, 9.9)
+        for _ in range(10):
+            limiter.on_success()
+        self.assertEqual(limiter.rate, 10.0)
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(3, 60.0)
+        for _ in range(2):
+            breaker.record_failure()
+        breaker.before_request()
+        breaker.record_failure()
+        self.assertRaises(CircuitOpenError, breaker.before_request)
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(2, 60.0)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.before_request()
+
+    def test_half_open_allows_single_trial(self):
+        breaker = CircuitBreaker(1, 0.0)
+        breaker.record_failure()
+        breaker.before_request()
+        self.assertRaises(CircuitOpenError, breaker.before_request)
+
+    def test_successful_trial_closes(self):
+        breaker = CircuitBreaker(1, 0.0)
+        breaker.record_failure()
+        breaker.before_request()
+        breaker.record_success()
+        breaker.before_request()
+        breaker.before_request()
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker(5, 60.0)
+        for _ in range(5):
+            breaker.record_failure()
+        breaker.opened -= 60.0
+        breaker.before_request()
+        breaker.record_failure()
+        self.assertRaises(CircuitOpenError, breaker.before_request)
@@ -0,0 +1,227 @@
+import sys
+import types
+import unittest
+from unittest import mock
+
+class QueryDeadlockError(Exception):
+    pass
+
+class QueryTimeoutError(Exception):
+    pass
+
+class FakeDatabase:
+    """Records the calls of frappe.db. Like the database, a rollback to a savepoint that was lost
+    with the transaction fails."""
+
+    def __init__(self):
+        self.calls = []
+        self.savepoints = []
+
+    def savepoint(self, save_point: str):
+        self.calls.append(("savepoint", save_point))
+        self.savepoints.append(save_point)
+
+    def rollback(self, save_point: str = None):
+        self.calls.append(("rollback", save_point))
+        if save_point is None:
+            self.savepoints = []
+        elif save_point not in self.savepoints:
+            raise RuntimeError(f"SAVEPOINT {save_point} does not exist")
+
+    def commit(self):
+        self.calls.append(("commit", None))
+        self.savepoints = []
+
+def fake_frappe():
+    return types.SimpleNamespace(db=FakeDatabase(),
+                                 QueryDeadlockError=QueryDeadlockError,
+                                 QueryTimeoutError=QueryTimeoutError)
+
+try:
+    import frappe
+except ImportError:
+    # The policy only needs frappe.db and two exception types, which are replaced in every test
+    sys.modules["frappe"] = fake_frappe()
+    from weclapp_migration.tools import transaction
+    del sys.modules["frappe"]
+else:
+    from weclapp_migration.tools import transaction
+
+try:
+    from weclapp_migration.migration import migration
+except ImportError:
+    migration = None
+
+from weclapp_migration.tools.transaction import TransactionPolicy, TransactionLostError
+
+class TransactionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.frappe = fake_frappe()
+        self.db = self.frappe.db
+        for patcher in (mock.patch.object(transaction, "frappe", self.frappe),
+                        mock.patch.object(transaction, "LOST_TRANSACTION_ERRORS", (QueryDeadlockError, QueryTimeoutError))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def commits(self) -> int:
+        return self.db.calls.count(("commit", None))
+
+class TestTransactionPolicy(TransactionTestCase):
+    def test_batch_commits_every_batch_size_records(self):
+        policy = TransactionPolicy(2)
+        with policy.batch():
+            for _ in range(5):
+                with policy.record():
+                    pass
+            self.assertEqual(self.commits(), 2)
+        self.assertEqual((self.commits(), policy.commits, policy.pending), (3, 3, 0))
+
+    def test_commits_every_record_outside_of_a_batch(self):
+        policy = TransactionPolicy(10)
+        for _ in range(3):
+            with policy.record():
+                pass
+        self.assertEqual(self.commits(), 3)
+
+    def test_nested_records_commit_with_the_outermost(self):
+        policy = TransactionPolicy(1)
+        with policy.batch():
+            with policy.record():
+                with policy.record():
+                    pass
+                self.assertEqual(self.commits(), 0)
+            self.assertEqual(self.commits(), 1)
+
+    def test_error_rolls_back_only_the_record(self):
+        policy = TransactionPolicy(10)
+        undone = []
+        with policy.batch():
+            with policy.record():
+                policy.on_rollback(lambda: undone.append("kept"))
+            with self.assertRaises(ValueError):
+                with policy.record():
+                    policy.on_rollback(lambda: undone.append("first"))
+                    policy.on_rollback(lambda: undone.append("second"))
+                    raise ValueError()
+            self.assertEqual(undone, ["second", "first"])
+            self.assertIn(("rollback", "weclapp_record_0"), self.db.calls)
+            self.assertNotIn(("rollback", None), self.db.calls)
+            self.assertEqual(policy.pending, 1)
+
+    def test_failed_nested_record_keeps_the_enclosing_record(self):
+        policy = TransactionPolicy(10)
+        undone = []
+        with policy.record():
+            policy.on_rollback(lambda: undone.append("outer"))
+            with self.assertRaises(ValueError):
+                with policy.record():
+                    policy.on_rollback(lambda: undone.append("inner"))
+                    raise ValueError()
+        self.assertEqual(undone, ["inner"])
+        self.assertIn(("rollback", "weclapp_record_1"), self.db.calls)
+        self.assertEqual(self.commits(), 1)
+
+    def test_deadlock_in_nested_record_loses_the_transaction(self):
+        policy = TransactionPolicy(10)
+        undone = []
+        with policy.batch():
+            with policy.record():
+                policy.on_rollback(lambda: undone.append("uncommitted"))
+            with self.assertRaises(TransactionLostError):
+                with policy.record():
+                    policy.on_rollback(lambda: undone.append("outer"))
+                    try:
+                        with policy.record():
+                            policy.on_rollback(lambda: undone.append("inner"))
+                            raise QueryDeadlockError()
+                    except TransactionLostError:
+                        # The enclosing record can't continue in a transaction that is gone
+                        raise
+            self.assertEqual(undone, ["inner", "outer", "uncommitted"])
+            self.assertEqual(self.db.calls.count(("rollback", None)), 1)
+            self.assertEqual((policy.pending, policy.uncommitted, policy.lost, policy.depth), (0, [], False, 0))
+        self.assertEqual(self.commits(), 0)
+
+    def test_lost_savepoint_loses_the_transaction(self):
+        policy = TransactionPolicy(10)
+        with self.assertRaises(TransactionLostError):
+            with policy.record():
+                # E.g. a lock wait timeout reported as another error
+                self.db.savepoints = []
+                raise ValueError()
+        self.assertIn(("rollback", None), self.db.calls)
+
+    def test_committed_records_are_not_undone(self):
+        policy = TransactionPolicy(1)
+        undone = []
+        with policy.batch():
+            with policy.record():
+                policy.on_rollback(lambda: undone.append("committed"))
+            with self.assertRaises(TransactionLostError):
+                with policy.record():
+                    raise QueryTimeoutError()
+        self.assertEqual(undone, [])
+
+    def test_deferred_callbacks_run_after_the_rollback(self):
+        policy = TransactionPolicy(10)
+        logged = []
+        with self.assertRaises(TransactionLostError):
+            with policy.record():
+                with policy.record():
+                    policy.defer(lambda: logged.append(list(self.db.calls)))
+                    self.assertEqual(logged, [])
+                    raise QueryDeadlockError()
+        self.assertEqual(len(logged), 1)
+        self.assertEqual(logged[0][-1], ("rollback", None))
+
+    def test_deferred_callbacks_run_at_once_outside_of_records(self):
+        policy = TransactionPolicy(10)
+        logged = []
+        policy.defer(lambda: logged.append(True))
+        self.assertEqual(logged, [True])
+
+@unittest.skipIf(migration is None, "the migrations need frappe")
+class TestMigrateUnits(TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(migration.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.policy = TransactionPolicy(2)
+        self.logs = []
+        self.mig = types.SimpleNamespace(
+            en_doctype="Lead",
+            api=types.SimpleNamespace(transaction=self.policy,
+                                      config=types.SimpleNamespace(wc_transaction_retries=2),
+                                      log=lambda *args: self.logs.append(args)))
+
+    def migrate_units(self, units: list, fail: dict) -> tuple[list, list]:
+        """Migrates the units with Migration._migrate_units; fail maps a unit to the number of deadlocks it raises."""
+        calls = []
+
+        def migrate(unit):
+            calls.append(unit)
+            with self.policy.record():
+                if fail.get(unit, 0):
+                    fail[unit] -= 1
+                    raise QueryDeadlockError()
+            return [unit]
+
+        with self.policy.batch():
+            return migration.Migration._migrate_units(self.mig, units, migrate), calls
+
+    def test_retries_the_uncommitted_units(self):
+        en_docs, calls = self.migrate_units([1, 2, 3, 4, 5], {4: 1})
+        self.assertEqual(en_docs, [1, 2, 3, 4, 5])
+        # 1 and 2 are committed, 3 was rolled back with 4
+        self.assertEqual(calls, [1, 2, 3, 4, 3, 4, 5])
+        self.assertEqual(len(self.logs), 1)
+
+    def test_gives_up_after_the_retries(self):
+        with self.assertRaises(TransactionLostError):
+            self.migrate_units([1, 2], {2: 3})
+
+    def test_nested_migrations_are_retried_with_their_parent(self):
+        with self.assertRaises(TransactionLostError):
+            with self.policy.record():
+                self.migrate_units([1], {1: 1})
@@ -0,0 +1,30 @@
+import frappe
+
+class Barrier:
+    """Completion barrier for parallel jobs, counted in Redis.
+    Every job arrives once; the last job to arrive is told so and continues with the next stage."""
+
+    def __init__(self, name: str, parties: int, expires: int = 7 * 24 * 3600):
+        """
+        Args:
+            name (str): Unique name of the barrier (e.g. run and stage)
+            parties (int): Number of jobs that have to arrive
+            expires (int, optional): Seconds until an abandoned barrier is removed. Defaults to 7 days.
+        """
+        self.cache = frappe.cache()
+        self.key = self.cache.make_key(f"weclapp_migration:barrier:{name}")
+        self.parties = parties
+        self.expires = expires
+
+    def arrive(self) -> bool:
+        """Registers the arrival of a job.
+
+        Returns:
+            bool: True if this was the last job to arrive
+        """
+        arrived = self.cache.incr(self.key)
+        self.cache.expire(self.key, self.expires)
+        return arrived == self.parties
+
+    def get_arrived(self) -> int:
+        return int(self.cache.get(self.key) or 0)
@@ -1,7 +1,11 @@
 import frappe
+import hashlib
+import json
 import pytz
 import re
+from collections.abc import Mapping
 from datetime import datetime
+from frappe.model.base_document import BaseDocument
 
 @staticmethod
 def standardize_phone_number(number: str) -> str:
@@ -128,4 +132,31 @@ def get_datetime_from_weclapp_ts(timestamp: int) -> str:
     if not timestamp:
         return None
     system_timezone = frappe.db.get_single_value('System Settings', 'time_zone')
-    return datetime.fromtimestamp(timestamp / 1000, pytz.timezone(system_timezone)).strftime("%Y-%m-%d %H:%M:%S")
\ No newline at end of file
+    return datetime.fromtimestamp(timestamp / 1000, pytz.timezone(system_timezone)).strftime("%Y-%m-%d %H:%M:%S")
+
+# Fields frappe sets by itself when a document is created or saved, so they are no content
+VOLATILE_FIELDS = frozenset(("name", "owner", "creation", "modified", "modified_by", "docstatus", "idx",
+                             "parent", "parentfield", "parenttype", "added_by", "added_on"))
+
+@staticmethod
+def get_content_hash(value) -> str:
+    """Returns a stable hash of the given value (dicts, lists, scalars and frappe documents), independent of key order.
+    Documents (e.g. the CRM Notes of a lead) are hashed by their fields, without the volatile ones.
+
+    Args:
+        value: Value to hash
+
+    Returns:
+        str: SHA-1 hex digest
+    """
+    content = json.dumps(value, sort_keys=True, separators=(",", ":"), default=_get_hashable)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+def _get_hashable(value):
+    """Converts values json can't serialize for get_content_hash."""
+    if isinstance(value, BaseDocument):
+        return {field: v for field, v in value.as_dict(convert_dates_to_str=True).items()
+                if field not in VOLATILE_FIELDS and not field.startswith("_")}
+    if isinstance(value, Mapping):
+        return dict(value)
+    return str(value)
@@ -0,0 +1,127 @@
+import frappe
+from contextlib import contextmanager
+
+# Errors after which the database has rolled back the whole transaction, not only the statement
+LOST_TRANSACTION_ERRORS = (frappe.QueryDeadlockError, frappe.QueryTimeoutError)
+
+class TransactionLostError(Exception):
+    """Raised when the database rolled back the whole transaction (e.g. after a deadlock or lock wait timeout).
+    All records since the last commit are lost and have to be written again."""
+    pass
+
+class TransactionPolicy:
+    """Controls when migration work is committed.
+    Inside a batch, written records are committed every batch_size records instead of
+    once at the end or after every statement. Each record runs in its own savepoint, so
+    an error rolls back only that record. Records can be nested (e.g. contacts of a customer);
+    commits only happen outside of records. Outside of a batch every write is committed at once.
+    If the database rolls back the whole transaction, the uncommitted records are undone
+    (including their rollback callbacks) and TransactionLostError is raised."""
+
+    def __init__(self, batch_size: int):
+        self.batch_size = max(1, batch_size)
+        self.pending = 0
+        self.depth = 0
+        self.callbacks = []
+        self.uncommitted = []
+        self.deferred = []
+        self.lost = False
+        self.batches = 0
+        self.commits = 0
+
+    @contextmanager
+    def batch(self):
+        """Runs the enclosed migration or clearing run in batches and commits the rest at the end."""
+        self.batches += 1
+        try:
+            yield self
+        finally:
+            self.batches -= 1
+            if not self.batches:
+                self.flush()
+
+    @contextmanager
+    def record(self, count: int = 1):
+        """Runs the enclosed work of one record (or a batch of count records) in a savepoint.
+        On an error the record is rolled back to the savepoint, its rollback callbacks are run
+        and the error is raised again.
+
+        Raises:
+            TransactionLostError: The database rolled back the whole transaction
+        """
+        save_point = f"weclapp_record_{self.depth}"
+        frappe.db.savepoint(save_point)
+        self.depth += 1
+        self.callbacks.append([])
+        try:
+            yield
+        except BaseException as e:
+            callbacks = self.callbacks.pop()
+            if self.lost:
+                # Already undone by the nested record that lost the transaction
+                raise
+            if not isinstance(e, LOST_TRANSACTION_ERRORS):
+                try:
+                    frappe.db.rollback(save_point=save_point)
+                except Exception:
+                    # The savepoint is gone with the transaction
+                    pass
+                else:
+                    for callback in reversed(callbacks):
+                        callback()
+                    raise
+            self._lose(callbacks)
+            raise TransactionLostError(f"Transaction rolled back by the database: {e}") from e
+        else:
+            # A rollback of the enclosing record (or of the transaction) also undoes this record
+            callbacks = self.callbacks.pop()
+            (self.callbacks[-1] if self.callbacks else self.uncommitted).extend(callbacks)
+        finally:
+            self.depth -= 1
+            if not self.depth:
+                self.lost = False
+                self._run_deferred()
+        self.written(count)
+
+    def on_rollback(self, callback):
+        """Registers a callback that undoes in-memory state (e.g. identity maps) if the current record is rolled back."""
+        if self.callbacks:
+            self.callbacks[-1].append(callback)
+
+    def defer(self, callback):
+        """Runs the callback after the outermost record ended, so its writes (e.g. error logs)
+        are not rolled back with the record. Outside of records it runs at once."""
+        if self.depth:
+            self.deferred.append(callback)
+        else:
+            callback()
+
+    def written(self, count: int = 1):
+        """Counts written records and commits if the batch is full."""
+        self.pending += count
+        if not self.batches or self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Commits the pending records unless a record is still in progress."""
+        if self.depth or not self.pending:
+            return
+        frappe.db.commit()
+        self.pending = 0
+        self.uncommitted = []
+        self.commits += 1
+
+    def _lose(self, callbacks: list):
+        """Rolls back the whole transaction and undoes all uncommitted records, newest first."""
+        frappe.db.rollback()
+        self.lost = True
+        for callback in reversed([*self.uncommitted, *[cb for level in self.callbacks for cb in level], *callbacks]):
+            callback()
+        self.uncommitted = []
+        self.callbacks = [[] for _ in self.callbacks]
+        self.pending = 0
+
+    def _run_deferred(self):
+        deferred, self.deferred = self.deferred, []
+        for callback in deferred:
+            callback()
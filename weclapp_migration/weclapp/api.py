@@ -1,14 +1,52 @@
 import frappe
 import requests
-from pysondb import PysonDB
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, defaultdict, Counter
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+import os
+import random
 import shutil
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timezone
+from .blobs import BlobStore
+from . import codec
+from .cache import BatchWriter, CacheStore, CacheManifest, RecordCache
+from .download import DocumentDownloader
+from .query import as_query
+from .record import RecordSchema
+from .snapshot import Generations, SnapshotStore, SnapshotWriter, link_snapshot
+from .diff import SnapshotDiff, diff_snapshots
+from .throttle import AdaptiveRateLimiter, CircuitBreaker, CircuitOpenError
+from ..tools.transaction import TransactionPolicy
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+THROTTLE_STATUS_CODES = (429, 503)
+
+class WeclappApiError(frappe.ValidationError):
+    """Raised when a request to the WeClapp API fails."""
+    pass
+
+class CacheDeadlineError(Exception):
+    """Raised at a checkpoint when the deadline of the cache job is reached."""
+    pass
 
 class Api:
     """Class for accessing WeClapp API and caching data locally."""
     def __init__(self):
         self.config = frappe.get_single("Weclapp Migration Settings")
+        self.limiter = AdaptiveRateLimiter(self.config.wc_rate_limit,
+                                           self.config.wc_min_rate_limit,
+                                           self.config.wc_max_rate_limit)
+        self.breaker = CircuitBreaker(self.config.wc_breaker_threshold, self.config.wc_breaker_timeout)
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+        self.deadline = None
+        self.schemas = {}
+        self.identity_maps = {}
+        self.transaction = TransactionPolicy(self.config.wc_commit_batch_size)
 
     def __enter__(self):
         self.session = requests.Session()
@@ -16,66 +54,322 @@ class Api:
             "Content-Type"          : "application/json",
             "AuthenticationToken"   : self.config.get_password("wc_api_token")
         }
+        # One connection pool shared by all page and download workers
+        pool_size = self.config.wc_workers + self.config.wc_download_workers
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.config.wc_workers, thread_name_prefix="weclapp")
+        self.manifest = CacheManifest(f"{self._get_cache_base()}manifest.json")
+        self.blobs = BlobStore(f"{self._get_cache_base()}blobs/")
+        self.store = CacheStore(f"{self._get_cache_base()}cache.sqlite3", self.config.wc_cache_indexes)
+        self.generations = Generations(f"{self._get_cache_base()}generations/", self.config.wc_cache_generations)
+        self._open_reader()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        self.executor.shutdown(wait=True, cancel_futures=True)
         self.session.close()
+        self.store.close()
+        if self.reader is not self.store:
+            self.reader.close()
+
+    def _open_reader(self):
+        """Opens the backend the cached entities are read from (wc_cache_backend) and the record cache on top of it."""
+        if self.config.wc_cache_backend == "snapshot":
+            self.reader = SnapshotStore(f"{self._get_cache_base()}snapshot/")
+        else:
+            self.reader = self.store
+        self.records = RecordCache(self.reader, self.config.wc_record_cache_mb * 1024 * 1024)
     
-    def setup_cache(self):
-        """Clears the cache & log and creates the cache folders."""
+    def setup_cache(self, delta: bool = False):
+        """Clears the cache & log and creates the cache folders.
+        In delta mode the existing cache and log are kept.
+        The document blob store and the cache generations are always kept,
+        so stored documents are not downloaded again and the next run can be compared to the last one."""
         cache_base = Path(self._get_cache_base())
-        # Clear cache
-        if cache_base.exists():
-            shutil.rmtree(cache_base)
-        # Clear log
-        frappe.db.sql("DELETE FROM `tabWeclapp Migration Log`")
-        frappe.db.commit()
+        if not delta:
+            # Clear cache
+            self.store.close()
+            for path in cache_base.iterdir() if cache_base.exists() else []:
+                if path.name in ("blobs", "generations"):
+                    continue
+                shutil.rmtree(path) if path.is_dir() else path.unlink()
+            # Clear log
+            frappe.db.sql("DELETE FROM `tabWeclapp Migration Log`")
+            frappe.db.commit()
+            self.manifest = CacheManifest(f"{self._get_cache_base()}manifest.json")
+            self.store = CacheStore(f"{self._get_cache_base()}cache.sqlite3", self.config.wc_cache_indexes)
+            self._open_reader()
         # Create cache folders
         Path(cache_base.joinpath("documents")).mkdir(parents=True, exist_ok=True)
 
-    def cache_doctype(self, doctype: str):
-        """Caches all entities of the given DocType and saves them in JSON-files.
-        Overrides existing files."""
-        # Fetch entities and save them in JSON-files
-        wc_data = self._get_all(doctype)
-        cache_db = PysonDB(f"{self._get_cache_base()}{doctype}.json")
-        cache_db.add_many(wc_data)
-        for obj in wc_data:
-            # Fetch documents and save them in files
-            documents = self._request(f"document", "GET",
-                                      params={
-                                          "entityName": doctype,
-                                          "entityId": obj["id"]
-                                      }).json()["result"]
-            for doc in documents:
-                # Add meta data to document-object: doctype and id
-                doc["entityName"] = doctype
-                doc["entityId"] = obj["id"]
-                base_path = Path(self._get_cache_base()).joinpath(f"documents/{doctype}/{obj['id']}/")
-                base_path.mkdir(parents=True, exist_ok=True)
-                with open(base_path.joinpath(doc["name"]), "wb") as file:
-                    file.write(self._request(f"document/id/{doc['id']}/download", "GET").content)
-            
-            if doctype in self.config.wc_mail_doctypes:
-                # Fetch archived emails and save them in JSON-files
-                emails = self._request(f"archivedEmail", "GET",
-                                       params={
-                                           "entityName": doctype,
-                                           "entityId": obj["id"],
-                                           "serializeNulls": "true"
-                                       }).json()["result"]
+    def cache_doctype(self, doctype: str, delta: bool = False, properties: list[str] = None, run_id: str = None):
+        """Caches all entities of the given DocType in the cache database.
+        Pages are written to the cache as they arrive.
+        If properties are given, only these (and the ones needed for caching) are fetched.
+
+        In delta mode only entities modified since the recorded high-water mark are fetched
+        and merged into the existing cache by ID. Entities deleted in WeClapp are not detected.
+
+        Progress is checkpointed in the manifest after every page and phase (entities, documents, emails).
+        If a checkpoint of the given run exists, caching continues after the last finished page.
+        The IDs of changed entities are recorded in the cache store with their page, the checkpoint only counts them.
+
+        Raises:
+            CacheDeadlineError: The deadline was reached at a checkpoint
+        """
+        state = self.manifest.get(doctype)
+        checkpoint = state.get("checkpoint", None)
+        if not run_id or not checkpoint or checkpoint.get("run", None) != run_id:
+            since = state.get("high_water_mark", None) if delta and self.store.exists(doctype) else None
+            checkpoint = {
+                "run"               : run_id,
+                "phase"             : "entities",
+                "since"             : since,
+                "page"              : 0,
+                "high_water_mark"   : since or 0,
+                "changed"           : 0
+            }
+            self.store.clear_changed(doctype)
+        if checkpoint["phase"] == "entities":
+            self._cache_entities(doctype, properties, checkpoint)
+            self._checkpoint(doctype, checkpoint, phase="documents")
+        # In delta mode only the changed entities need their attachments, otherwise all
+        ids = self.store.get_changed(doctype) if checkpoint["since"] else None
+        if checkpoint["phase"] == "documents":
+            if checkpoint["since"]:
+                self._clear_cached_documents(doctype, ids)
+            if doctype not in self.config.wc_skip_document_doctypes:
+                self._cache_documents(doctype, ids)
+            self._checkpoint(doctype, checkpoint, phase="emails")
+        if checkpoint["phase"] == "emails" and doctype in self.config.wc_mail_doctypes:
+            # Emails of a partly finished phase or previous run are replaced
+            self._clear_cached_emails(doctype, ids)
+            self._cache_emails(doctype, ids)
+        self.manifest.update(doctype,
+                             high_water_mark=checkpoint["high_water_mark"],
+                             cached=datetime.now().isoformat(),
+                             run=run_id,
+                             checkpoint=None)
+        self.store.clear_changed(doctype)
+
+    def _cache_entities(self, doctype: str, properties: list[str], checkpoint: dict):
+        """Fetches the entities of the given DocType page by page and writes them to the cache.
+        Every page is written in one transaction; existing entities are replaced by ID."""
+        since = checkpoint["since"]
+        for page in self._iter_pages(doctype,
+                                     {"lastModifiedDate-gt": since} if since else None,
+                                     properties,
+                                     checkpoint["page"] + 1):
+            self.store.add_many(doctype, page, changed=bool(since))
+            for obj in page:
+                checkpoint["high_water_mark"] = max(checkpoint["high_water_mark"],
+                                                    obj.get("lastModifiedDate", None) or 0)
+            if since:
+                checkpoint["changed"] += len(page)
+            self._checkpoint(doctype, checkpoint, page=checkpoint["page"] + 1)
+            self._check_deadline()
+
+    def _checkpoint(self, doctype: str, checkpoint: dict, **values):
+        """Updates the checkpoint of the given DocType and saves it in the manifest."""
+        checkpoint.update(values)
+        self.manifest.update(doctype, checkpoint=checkpoint)
+
+    def _check_deadline(self):
+        if self.deadline and time.monotonic() > self.deadline:
+            raise CacheDeadlineError("Deadline of the cache job reached")
+
+    def _clear_cached_documents(self, doctype: str, ids: list):
+        """Removes cached documents of the given entities before they are refetched."""
+        for id in ids:
+            shutil.rmtree(Path(self._get_cache_base()).joinpath(f"documents/{doctype}/{id}/"), ignore_errors=True)
+
+    def _clear_cached_emails(self, doctype: str, ids: list = None):
+        """Removes cached archived emails of the given entities (None for all) before they are refetched."""
+        if ids is None:
+            self.store.delete("archivedEmail", "entityName", [doctype])
+        else:
+            self.store.delete("archivedEmail", "entityId", ids, {"entityName": doctype})
+
+    def _cache_documents(self, doctype: str, ids: list):
+        """Fetches the documents of the given entities and saves them in files.
+        Downloads run in the background while the document metadata is still being paged.
+        Documents already in the blob store are only linked.
+        The blob manifest is saved even if caching is interrupted, so finished downloads are kept."""
+        try:
+            with DocumentDownloader(self,
+                                    self.config.wc_download_workers,
+                                    self.config.wc_download_queue_size,
+                                    self.config.wc_download_chunk_size) as downloader:
+                for entity_id, documents in self._iter_attached("document", doctype, ids):
+                    self._check_deadline()
+                    base_path = Path(self._get_cache_base()).joinpath(f"documents/{doctype}/{entity_id}/")
+                    base_path.mkdir(parents=True, exist_ok=True)
+                    for doc in documents:
+                        key = self.blobs.get_key(doc)
+                        target = base_path.joinpath(doc["name"])
+                        if self.blobs.has(key, self.config.wc_verify_blobs):
+                            self.blobs.link(key, target)
+                        else:
+                            downloader.submit(doc["id"], self.blobs.get_tmp_path(key),
+                                              lambda path, sha256, size, key=key, target=target: \
+                                                self.blobs.add(key, path, sha256, size, target))
+        finally:
+            self.blobs.save()
+        for error in downloader.errors:
+            self.log("Error", f"Error while downloading a document of {doctype}", error)
+
+    def _cache_emails(self, doctype: str, ids: list):
+        """Fetches the archived emails of the given entities and saves them in the cache.
+        Emails are written in large batches; large loads build the indexes once at the end."""
+        with BatchWriter(self.store, "archivedEmail", self.config.wc_email_batch_size) as writer:
+            for entity_id, emails in self._iter_attached("archivedEmail", doctype, ids, {"serializeNulls": "true"}):
+                self._check_deadline()
                 for email in emails:
                     # Add meta data to email-object: doctype and id
                     email["entityName"] = doctype
-                    email["entityId"] = obj["id"]
-                cache_db = PysonDB(f"{self._get_cache_base()}archivedEmail.json")
-                cache_db.add_many(emails)
-
-    def get_cache_objects(self, doctype: str, query = None):
-        """Gets all cached entities of the given DocType."""
-        cache_db = PysonDB(f"{self._get_cache_base()}{doctype}.json")
-        return cache_db.get_by_query(query).values() if query else cache_db.get_all().values()
-    
+                    email["entityId"] = entity_id
+                writer.add(emails)
+
+    def _iter_attached(self, resource: str, doctype: str, ids: list, params: dict = None):
+        """Yields the objects of the given resource (e.g. document, archivedEmail) attached to
+        the given entities (None for all cached entities), grouped by entity ID.
+
+        In bulk mode the resource is paged once per entityName and grouped locally,
+        otherwise it is requested once per entity. An entity may be yielded more than once
+        if its objects span several pages."""
+        if self.config.wc_bulk_attachments:
+            wanted = set(ids) if ids is not None else None
+            for page in self._iter_pages(resource, {**(params or {}), "entityName": doctype}):
+                groups = defaultdict(list)
+                for obj in page:
+                    if obj.get("entityId", None) and (wanted is None or obj["entityId"] in wanted):
+                        groups[obj["entityId"]].append(obj)
+                yield from groups.items()
+        else:
+            if ids is None:
+                ids = self.store.get_ids(doctype)
+            for id in ids:
+                objects = codec.loads(self._request(resource, "GET",
+                                                    params={
+                                                        **(params or {}),
+                                                        "entityName": doctype,
+                                                        "entityId": id
+                                                    }).content)["result"]
+                if objects:
+                    yield id, objects
+
+    def get_cache_objects(self, doctype: str, query = None, fields: list[str] = None):
+        """Gets all cached entities of the given DocType.
+        The decoded entities are kept in the record cache of this run, so repeated calls don't decode them again.
+
+        Args:
+            doctype (str): WeClapp-DocType
+            query (Query | dict | callable, optional): Query planned against the indexes of the fields
+                declared in wc_cache_indexes, field values to match or filter function (scans all entities).
+                Defaults to None.
+            fields (list, optional): Properties read by the caller. If wc_compact_records is set, the entities
+                are returned as compact records with only these (top-level) fields. Defaults to None.
+        """
+        schema = self._get_schema(fields) if fields and self.config.wc_compact_records else None
+        query = as_query(query)
+        if query is None:
+            return list(self.records.get(doctype, schema))
+        indexes = self.records.get_indexes(doctype, self.config.wc_cache_indexes.get(doctype, []), schema)
+        objects, index = query.candidates(indexes)
+        frappe.logger("weclapp_migration").debug(f"Cache query on {doctype}: {query!r} using {index or 'full scan'}")
+        if objects is None:
+            objects = self.records.get(doctype, schema)
+        return [obj for obj in objects if query.match(obj)]
+
+    def _get_schema(self, fields: list[str]) -> RecordSchema:
+        """Gets the shared record schema for the given properties."""
+        key = tuple(fields)
+        if key not in self.schemas:
+            self.schemas[key] = RecordSchema.from_properties(fields)
+        return self.schemas[key]
+
+    def get_cache_object(self, doctype: str, id: str) -> dict:
+        """Gets the cached entity of the given DocType and ID without loading the whole DocType."""
+        return self.reader.get(doctype, id)
+
+    def iter_cache_objects(self, doctype: str):
+        """Yields the cached entities of the given DocType one by one without keeping them in memory."""
+        yield from self.reader.get_all(doctype)
+
+    def write_snapshots(self, base: str = None):
+        """Writes the cached entities of every DocType as compressed snapshot (see SnapshotWriter).
+        Snapshots written after the last change of their DocType are kept, so unchanged DocTypes
+        are not written again and an interrupted run continues with the missing ones.
+
+        Args:
+            base (str, optional): Folder of the snapshots. Defaults to the snapshot folder of the cache.
+
+        Raises:
+            CacheDeadlineError: The deadline was reached before all snapshots were written
+        """
+        base = base or f"{self._get_cache_base()}snapshot/"
+        snapshots = SnapshotStore(base)
+        for doctype in self.store.get_doctypes():
+            stamp = snapshots.get_stamp(doctype)
+            if stamp is not None and stamp >= (self.store.get_stamp(doctype) or 0):
+                continue
+            self._check_deadline()
+            with SnapshotWriter(base,
+                                doctype,
+                                self.config.wc_snapshot_chunk_records,
+                                self.config.wc_snapshot_compress) as writer:
+                for id, data in self.store.iter_items(doctype):
+                    writer.add(id, data)
+
+    def create_generation(self, run_id: str) -> str:
+        """Saves the current cache as a new generation and removes the oldest generations.
+        If the cache is read from snapshots, their files are linked instead of written again.
+        The generation is assembled in a folder of the run, so an interrupted run continues it.
+
+        Args:
+            run_id (str): ID of the cache run
+
+        Returns:
+            str: Name of the new generation
+
+        Raises:
+            CacheDeadlineError: The deadline was reached before the generation was complete
+        """
+        tmp_path = self.generations.get_path(f"{run_id}.part")
+        self.generations.clear_unfinished(keep=tmp_path.name)
+        if self.config.wc_cache_backend == "snapshot":
+            snapshots = SnapshotStore(f"{self._get_cache_base()}snapshot/")
+            for doctype in self.store.get_doctypes():
+                if tmp_path.joinpath(doctype).exists() or not snapshots.exists(doctype):
+                    continue
+                self._check_deadline()
+                link_snapshot(f"{self._get_cache_base()}snapshot/", str(tmp_path), doctype)
+        else:
+            self.write_snapshots(str(tmp_path))
+        name = datetime.now().strftime("%Y%m%d%H%M%S")
+        os.replace(tmp_path, self.generations.get_path(name))
+        self.generations.prune()
+        return name
+
+    def diff_generations(self, doctype: str, old: str = None, new: str = None) -> SnapshotDiff:
+        """Compares the entities of the given DocType in two cache generations.
+
+        Args:
+            doctype (str): WeClapp-DocType
+            old (str, optional): Older generation. Defaults to the generation before the new one.
+            new (str, optional): Newer generation. Defaults to the newest generation.
+        """
+        names = self.generations.list()
+        new = new or (names[-1] if names else None)
+        if new is None:
+            raise frappe.ValidationError("There is no cache generation to compare. Please enable cache generations "
+                                         "(wc_cache_generations) and cache the WeClapp Data first.")
+        older = [name for name in names if name < new]
+        old = old or (older[-1] if older else None)
+        return diff_snapshots(self.generations.open(old) if old else None, self.generations.open(new), doctype)
+
     def get_cache_documents(self, doctype: str, id: str) -> list[str]:
         """Gets all cached documents of the given DocType and ID."""
         base_path = Path(self._get_cache_base()).joinpath(f"documents/{doctype}/{id}/")
@@ -85,51 +379,149 @@ class Api:
             return []
     
     def log(self, status: str, message: str, traceback: str = None):
-        """Logs a message to the log DocType."""
+        """Logs a message to the log DocType. The entry is committed by the transaction policy.
+        Inside a migrated record the entry is written after the outermost record ended,
+        so it isn't rolled back together with the record."""
+        timestamp = datetime.now()
+        self.transaction.defer(lambda: self._write_log(status, message, traceback, timestamp))
+
+    def _write_log(self, status: str, message: str, traceback: str, timestamp: datetime):
         doc = frappe.get_doc({
             "doctype": "Weclapp Migration Log",
             "status": status,
             "message": message,
             "traceback": traceback,
-            "datetime": datetime.now()
+            "datetime": timestamp
         })
         doc.insert()
-        frappe.db.commit()
+        self.transaction.written()
+
+    def get_stats(self) -> str:
+        """Gets the request counters of this run as readable text."""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats["throttle_seconds"] = round(stats.get("throttle_seconds", 0), 1)
+        stats["rate_limit"] = round(self.limiter.rate, 1)
+        return ", ".join(f"{key}: {value}" for key, value in sorted(stats.items()))
 
     def _get_cache_base(self) -> str:
         return f"{frappe.local.site}/private/weclapp_migration/cache/"
 
-    def _get_all(self, doctype: str):
-        """Gets all entities of the given DocType."""
-        pages = (self._get_count(doctype) + self.config.wc_page_size - 1) // self.config.wc_page_size
-        result = []
-        for page in range(1, pages + 1):
-            result += self._get_page(doctype, page)
-        return result
+    def _iter_pages(self, doctype: str, params: dict = None, properties: list[str] = None, first_page: int = 1):
+        """Yields the pages of the given DocType in page order as they arrive.
+        Pages are fetched concurrently by the worker pool, but only a bounded window
+        of pages is in flight so memory stays flat regardless of the DocType size."""
+        pages = (self._get_count(doctype, params) + self.config.wc_page_size - 1) // self.config.wc_page_size
+        window = deque()
+        next_page = first_page
+        try:
+            while next_page <= pages or window:
+                while next_page <= pages and len(window) < 2 * self.config.wc_workers:
+                    window.append(self.executor.submit(self._fetch_page, doctype, next_page, params, properties))
+                    next_page += 1
+                yield window.popleft().result()
+        finally:
+            for future in window:
+                future.cancel()
+
+    def _fetch_page(self, doctype: str, page: int, params: dict = None, properties: list[str] = None):
+        """Gets a page of entities of the given DocType.
+        Failed requests are already retried by _request. The page is only fetched again if its
+        response breaks off while it is read (lost connection, truncated JSON)."""
+        for attempt in range(1, self.config.wc_page_retries + 1):
+            try:
+                return self._get_page(doctype, page, params, properties)
+            except (requests.RequestException, ValueError):
+                if attempt == self.config.wc_page_retries:
+                    raise
 
-    def _get_count(self, doctype: str) -> int:
+    def _get_count(self, doctype: str, params: dict = None) -> int:
         """Gets the amount of entities of the given DocType."""
-        return int(self._request(f"{doctype}/count", "GET").json()["result"])
-
-    def _get_page(self, doctype: str, page: int):
-        """Gets a page of entities of the given DocType."""
-        return self._request(doctype, "GET",
-                             params={
-                                 "serializeNulls": "true",
-                                 "pageSize": self.config.wc_page_size,
-                                 "page": page
-                            }) \
-                            .json()["result"]
-
-    def _request(self, doctype : str, method: str, data: dict = None, params: dict = None):
-        """Makes a request to WeClapp API."""
+        return int(codec.loads(self._request(f"{doctype}/count", "GET", params=params).content)["result"])
+
+    def _get_page(self, doctype: str, page: int, params: dict = None, properties: list[str] = None):
+        """Gets a page of entities of the given DocType.
+        If properties are given, the entities are projected to them (dotted paths for nested entities).
+        The response is streamed and its result array decoded element by element (see codec.iter_array),
+        so only the decoded entities of the page are kept, not the raw response. The page is returned
+        as a whole because it is written to the cache in one transaction."""
+        if properties:
+            params = {
+                **(params or {}),
+                "properties": ",".join(dict.fromkeys(["id", "version", "lastModifiedDate", *properties]))
+            }
+        with self._request(doctype, "GET",
+                           params={
+                               **(params or {}),
+                               "serializeNulls": "true",
+                               "pageSize": self.config.wc_page_size,
+                               "page": page,
+                               "sort": "id"
+                           },
+                           stream=True) as response:
+            return list(codec.iter_array(response.iter_content(chunk_size=64 * 1024), "result"))
+
+    def _request(self, doctype : str, method: str, data: dict = None, params: dict = None, stream: bool = False):
+        """Makes a request to WeClapp API.
+        Requests are rate limited; throttled, failed and timed out requests are retried
+        with exponential backoff (or as long as the server asks via Retry-After)."""
         url = f"{self.config.wc_api_base}{doctype}"
-        try:
-            response = self.session.request(method=method, url=url, json=data, params=params)
-            response.raise_for_status()
-        except requests.RequestException as e:
-            frappe.throw(f"WeClapp API-Error: {response.text}")
+        for attempt in range(1, self.config.wc_max_retries + 1):
+            retry_after = None
+            try:
+                self.breaker.before_request()
+                waited = self.limiter.acquire()
+                if waited:
+                    self._count("throttle_waits")
+                    self._count("throttle_seconds", waited)
+                self._count("requests")
+                response = self.session.request(method=method, url=url, json=data, params=params,
+                                                timeout=self.config.wc_request_timeout, stream=stream)
+            except CircuitOpenError as e:
+                error = f"{e}"
+                retry_after = self.config.wc_breaker_timeout
+            except requests.RequestException as e:
+                error = f"{e}"
+                self.breaker.record_failure()
+            else:
+                if response.ok:
+                    self.breaker.record_success()
+                    self.limiter.on_success()
+                    return response
+                error = f"{response.status_code} {response.text}"
+                response.close()
+                if response.status_code not in RETRY_STATUS_CODES:
+                    # The server answered, so it is reachable (also closes a half-open circuit)
+                    self.breaker.record_success()
+                    raise WeclappApiError(f"WeClapp API-Error: {error}")
+                self.breaker.record_failure()
+                if response.status_code in THROTTLE_STATUS_CODES:
+                    self._count("throttled")
+                    self.limiter.on_throttle()
+                retry_after = self._retry_after(response)
+            if attempt < self.config.wc_max_retries:
+                self._count("retries")
+                time.sleep(retry_after if retry_after is not None else self._backoff(attempt))
+        raise WeclappApiError(f"WeClapp API-Error after {self.config.wc_max_retries} attempts: {error}")
 
-        return response
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter for the given attempt."""
+        return random.uniform(0, min(self.config.wc_max_backoff, self.config.wc_base_backoff * 2 ** (attempt - 1)))
+
+    def _retry_after(self, response: requests.Response) -> float:
+        """Gets the delay requested by the Retry-After header (seconds or HTTP-date)."""
+        value = response.headers.get("Retry-After", None)
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                return None
 
-    
\ No newline at end of file
+    def _count(self, key: str, value: float = 1):
+        """Increments a per-run request counter."""
+        with self.stats_lock:
+            self.stats[key] += value
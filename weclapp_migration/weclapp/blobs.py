@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+class BlobStore:
+    """Content-addressed store for cached documents.
+    Every file is stored once under its SHA-256 hash. A manifest maps WeClapp documents
+    (ID and version) to their blob.
+    Entity paths (documents/{doctype}/{id}/{name}) are hard links to the blobs, so
+    identical files attached to several entities only take space once.
+    The manifest survives cache resets, so interrupted runs skip everything already stored."""
+
+    def __init__(self, base: str, flush_interval: int = 100):
+        self.base = Path(base)
+        self.manifest_path = self.base.joinpath("manifest.json")
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = 0
+        data = json.loads(self.manifest_path.read_text(encoding="utf-8")) \
+            if self.manifest_path.exists() else {}
+        self.documents = data.get("documents", {})
+        self.base.joinpath("tmp").mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def get_key(doc: dict) -> str:
+        """Gets the store key of the given WeClapp document: ID and version."""
+        return f"{doc['id']}:{doc.get('version', None) or ''}"
+
+    def get_blob_path(self, sha256: str) -> Path:
+        return self.base.joinpath(sha256[:2], sha256)
+
+    def get_tmp_path(self, key: str) -> Path:
+        """Gets the path to download the document with the given key to."""
+        return self.base.joinpath("tmp", key.replace(":", "_"))
+
+    def has(self, key: str, verify: bool = False) -> bool:
+        """Checks whether the document with the given key is stored.
+
+        Args:
+            key (str): Store key of the document
+            verify (bool, optional): Verify the content hash instead of only the size. Defaults to False.
+        """
+        with self.lock:
+            entry = self.documents.get(key, None)
+        if not entry:
+            return False
+        blob_path = self.get_blob_path(entry["sha256"])
+        if not blob_path.exists() or blob_path.stat().st_size != entry["size"]:
+            return False
+        return not verify or self._hash_file(blob_path) == entry["sha256"]
+
+    def add(self, key: str, path: Path, sha256: str, size: int, target: Path):
+        """Moves a downloaded file into the store and links it to the given entity path."""
+        blob_path = self.get_blob_path(sha256)
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        if blob_path.exists():
+            Path(path).unlink()
+        else:
+            os.replace(path, blob_path)
+        with self.lock:
+            self.documents[key] = {"sha256": sha256, "size": size}
+            self.pending += 1
+            flush = self.pending >= self.flush_interval
+        self.link(key, target)
+        if flush:
+            self.save()
+
+    def link(self, key: str, target: Path):
+        """Links the stored document with the given key to the given entity path."""
+        with self.lock:
+            blob_path = self.get_blob_path(self.documents[key]["sha256"])
+        target = Path(target)
+        target.unlink(missing_ok=True)
+        try:
+            os.link(blob_path, target)
+        except OSError:
+            shutil.copyfile(blob_path, target)
+
+    def save(self):
+        """Saves the manifest atomically."""
+        with self.lock:
+            data = json.dumps({"documents": self.documents})
+            self.pending = 0
+            tmp_path = self.manifest_path.with_name(f"{self.manifest_path.name}.part")
+            tmp_path.write_text(data, encoding="utf-8")
+            os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def _hash_file(path: Path) -> str:
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
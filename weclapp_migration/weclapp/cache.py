@@ -0,0 +1,437 @@
+import json
+import logging
+import os
+import sqlite3
+from bisect import bisect_left, bisect_right
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from . import codec
+from .record import RecordSchema
+
+class CacheStore:
+    """Cache of WeClapp entities in a local SQLite database.
+    Every DocType has its own table with the WeClapp-ID as primary key and the entity as JSON.
+    Declared secondary fields are stored in additional indexed columns.
+    The database runs in WAL mode, so migrations can read while the cache is written."""
+
+    def __init__(self, path: str, indexes: dict[str, list[str]] = None):
+        """Opens (or creates) the cache database.
+
+        Args:
+            path (str): Path of the database file
+            indexes (dict, optional): Indexed secondary fields per DocType. Defaults to None.
+        """
+        self.path = path
+        self.indexes = indexes or {}
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS _meta (doctype TEXT PRIMARY KEY, stamp INTEGER NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS _changed (doctype TEXT NOT NULL, id TEXT NOT NULL, "
+                                "PRIMARY KEY (doctype, id))")
+
+    def close(self):
+        self.connection.close()
+
+    @contextmanager
+    def transaction(self):
+        """Runs the enclosed statements in one transaction."""
+        self.connection.execute("BEGIN")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def exists(self, doctype: str) -> bool:
+        """Checks whether entities of the given DocType are cached."""
+        return self.connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                       (doctype,)).fetchone() is not None
+
+    def add_many(self, doctype: str, objects: list, changed: bool = False):
+        """Adds the given entities in one transaction. Existing entities with the same ID are replaced.
+
+        Args:
+            doctype (str): WeClapp-DocType
+            objects (list): Entities to add
+            changed (bool, optional): Also record the IDs as changed in the current delta run (see get_changed).
+                Defaults to False.
+        """
+        self._create_table(doctype)
+        fields = self._fields(doctype)
+        columns = ", ".join(["id", "data", *[self._column(field) for field in fields]])
+        placeholders = ", ".join("?" * (len(fields) + 2))
+        with self.transaction() as connection:
+            connection.executemany(f"INSERT OR REPLACE INTO {self._table(doctype)} ({columns}) VALUES ({placeholders})",
+                                   ((str(obj["id"]), codec.dumps(obj), *[obj.get(field, None) for field in fields])
+                                    for obj in objects))
+            if changed:
+                connection.executemany("INSERT OR IGNORE INTO _changed (doctype, id) VALUES (?, ?)",
+                                       ((doctype, str(obj["id"])) for obj in objects))
+            self._touch(connection, doctype)
+
+    def get(self, doctype: str, id: str) -> dict:
+        """Gets the cached entity of the given DocType and ID."""
+        if not self.exists(doctype):
+            return None
+        row = self.connection.execute(f"SELECT data FROM {self._table(doctype)} WHERE id = ?", (str(id),)).fetchone()
+        return codec.loads(row[0]) if row else None
+
+    def get_all(self, doctype: str):
+        """Yields all cached entities of the given DocType."""
+        if not self.exists(doctype):
+            return
+        for (data,) in self.connection.execute(f"SELECT data FROM {self._table(doctype)}"):
+            yield codec.loads(data)
+
+    def get_ids(self, doctype: str) -> list[str]:
+        """Gets the IDs of all cached entities of the given DocType."""
+        if not self.exists(doctype):
+            return []
+        return [id for (id,) in self.connection.execute(f"SELECT id FROM {self._table(doctype)}")]
+
+    def delete(self, doctype: str, field: str, values: list, filters: dict = None):
+        """Deletes the cached entities whose field has one of the given values
+        and that match all additional field values (fields have to be indexed)."""
+        if not self.exists(doctype) or not values:
+            return
+        filters = filters or {}
+        conditions = "".join(f" AND {self._column(f)} = ?" for f in filters)
+        column = "id" if field == "id" else self._column(field)
+        values = [str(v) for v in values] if field == "id" else list(values)
+        with self.transaction() as connection:
+            for chunk in self._chunks(values):
+                connection.execute(f"DELETE FROM {self._table(doctype)} "
+                                   f"WHERE {column} IN ({', '.join('?' * len(chunk))}){conditions}",
+                                   [*chunk, *filters.values()])
+            self._touch(connection, doctype)
+
+    def count(self, doctype: str) -> int:
+        """Gets the amount of cached entities of the given DocType."""
+        if not self.exists(doctype):
+            return 0
+        return self.connection.execute(f"SELECT COUNT(*) FROM {self._table(doctype)}").fetchone()[0]
+
+    def get_changed(self, doctype: str) -> list[str]:
+        """Gets the IDs of the entities recorded as changed in the current delta run."""
+        return [id for (id,) in self.connection.execute("SELECT id FROM _changed WHERE doctype = ?", (doctype,))]
+
+    def clear_changed(self, doctype: str):
+        """Forgets the IDs recorded as changed, e.g. when a new delta run starts."""
+        self.connection.execute("DELETE FROM _changed WHERE doctype = ?", (doctype,))
+
+    def get_stamp(self, doctype: str) -> int:
+        """Gets the write stamp of the given DocType. It changes whenever its entities are written or deleted."""
+        row = self.connection.execute("SELECT stamp FROM _meta WHERE doctype = ?", (doctype,)).fetchone()
+        return row[0] if row else None
+
+    def iter_raw(self, doctype: str):
+        """Yields the JSON of all cached entities of the given DocType without decoding it."""
+        if not self.exists(doctype):
+            return
+        for (data,) in self.connection.execute(f"SELECT data FROM {self._table(doctype)}"):
+            yield data
+
+    def iter_items(self, doctype: str):
+        """Yields the ID and JSON of all cached entities of the given DocType in ID order."""
+        if not self.exists(doctype):
+            return
+        yield from self.connection.execute(f"SELECT id, data FROM {self._table(doctype)} ORDER BY id")
+
+    def get_doctypes(self) -> list[str]:
+        """Gets the DocTypes with cached entities."""
+        return [doctype for (doctype,) in self.connection.execute("SELECT doctype FROM _meta ORDER BY doctype")
+                if self.exists(doctype)]
+
+    @staticmethod
+    def _touch(connection: sqlite3.Connection, doctype: str):
+        connection.execute("INSERT OR REPLACE INTO _meta (doctype, stamp) VALUES (?, ?)", (doctype, time.time_ns()))
+
+    @staticmethod
+    def _chunks(values: list, size: int = 500):
+        for i in range(0, len(values), size):
+            yield values[i:i + size]
+
+    def create_indexes(self, doctype: str):
+        """Creates the secondary indexes of the given DocType and updates the query planner statistics."""
+        if not self.exists(doctype):
+            return
+        for field in self._fields(doctype):
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS {self._index(doctype, field)} "
+                                    f"ON {self._table(doctype)} ({self._column(field)})")
+        self.connection.execute(f"ANALYZE {self._table(doctype)}")
+
+    def drop_indexes(self, doctype: str):
+        """Drops the secondary indexes of the given DocType, e.g. before a bulk load."""
+        for field in self._fields(doctype):
+            self.connection.execute(f"DROP INDEX IF EXISTS {self._index(doctype, field)}")
+
+    def _create_table(self, doctype: str):
+        if self.exists(doctype):
+            return
+        fields = self._fields(doctype)
+        columns = "".join(f", {self._column(field)}" for field in fields)
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS {self._table(doctype)} "
+                                f"(id TEXT PRIMARY KEY, data TEXT NOT NULL{columns})")
+        self.create_indexes(doctype)
+
+    def _fields(self, doctype: str) -> list[str]:
+        """Gets the indexed secondary fields of the given DocType (the ID is the primary key)."""
+        return [field for field in self.indexes.get(doctype, []) if field != "id"]
+
+    @staticmethod
+    def _table(name: str) -> str:
+        return '"' + name.replace('"', '""') + '"'
+
+    @staticmethod
+    def _column(field: str) -> str:
+        return '"idx_' + field.replace('"', '""') + '"'
+
+    def _index(self, doctype: str, field: str) -> str:
+        return self._table(f"{doctype}_{field}")
+
+class BatchWriter:
+    """Buffers entities for the cache store and writes them in large batches (one transaction each).
+    If a load is at least as large as the existing table, the secondary indexes are dropped before
+    the first batch and built once when the writer is finalised. Small loads (e.g. delta runs)
+    keep the indexes, since rebuilding them would cost more than maintaining them."""
+
+    def __init__(self, store: CacheStore, doctype: str, batch_size: int = 5000):
+        """
+        Args:
+            store (CacheStore): Store to write to
+            doctype (str): WeClapp-DocType of the entities
+            batch_size (int, optional): Buffered entities that trigger a flush. Defaults to 5000.
+        """
+        self.store = store
+        self.doctype = doctype
+        self.batch_size = batch_size
+        self.buffer = []
+        self.written = 0
+        self.existing = 0
+        self.indexes_dropped = False
+
+    def __enter__(self):
+        self.store._create_table(self.doctype)
+        self.existing = self.store.count(self.doctype)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Written batches stay valid if loading is interrupted, so they are always finalised
+        self.finalise()
+
+    def add(self, objects: list):
+        """Buffers the given entities and flushes the buffer when the batch size is reached."""
+        self.buffer += objects
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered entities in one transaction."""
+        if not self.buffer:
+            return
+        if not self.indexes_dropped and self.written + len(self.buffer) >= self.existing:
+            self.store.drop_indexes(self.doctype)
+            self.indexes_dropped = True
+        self.store.add_many(self.doctype, self.buffer)
+        self.written += len(self.buffer)
+        self.buffer = []
+
+    def finalise(self):
+        """Writes the remaining entities and rebuilds the indexes if they were dropped."""
+        self.flush()
+        if self.indexes_dropped:
+            self.store.create_indexes(self.doctype)
+            self.indexes_dropped = False
+
+class HashIndex:
+    """In-memory hash index over a field of cached entities.
+    Built with one pass over the entities, then every lookup is O(1)."""
+
+    def __init__(self, field: str, objects):
+        self.field = field
+        self.entries = {}
+        for obj in objects:
+            self.entries.setdefault(obj.get(field, None), []).append(obj)
+
+    def get(self, value) -> list[dict]:
+        """Gets the entities whose field has the given value."""
+        return self.entries.get(value, [])
+
+class SortedIndex:
+    """In-memory index over a field of cached entities, sorted by value for range lookups.
+    Entities without a value are not indexed."""
+
+    def __init__(self, field: str, objects):
+        self.field = field
+        entries = sorted(((obj[field], obj) for obj in objects if obj.get(field, None) is not None),
+                         key=lambda entry: entry[0])
+        self.values = [value for value, _ in entries]
+        self.objects = [obj for _, obj in entries]
+
+    def range(self, gt = None, gte = None, lt = None, lte = None) -> list[dict]:
+        """Gets the entities whose field lies in the given bounds (None for open bounds)."""
+        start, end = 0, len(self.values)
+        if gte is not None:
+            start = max(start, bisect_left(self.values, gte))
+        if gt is not None:
+            start = max(start, bisect_right(self.values, gt))
+        if lte is not None:
+            end = min(end, bisect_right(self.values, lte))
+        if lt is not None:
+            end = min(end, bisect_left(self.values, lt))
+        return self.objects[start:end]
+
+class DocTypeIndexes:
+    """Indexes of one DocType in the record cache, restricted to the declared fields."""
+
+    def __init__(self, records: "RecordCache", doctype: str, fields: list[str], schema: RecordSchema = None):
+        self.records = records
+        self.doctype = doctype
+        self.fields = fields
+        self.schema = schema
+
+    def hash(self, field: str) -> HashIndex:
+        return self.records.get_index(self.doctype, field, self.schema) if field in self.fields else None
+
+    def sorted(self, field: str) -> SortedIndex:
+        return self.records.get_sorted_index(self.doctype, field, self.schema) if field in self.fields else None
+
+class RecordCache:
+    """Run-scoped in-memory cache of decoded DocTypes.
+    Every DocType is loaded from the cache store once and kept together with its hash indexes.
+    If a record schema is given, the entities are kept as compact records with the schema's fields;
+    every schema of a DocType is cached separately.
+    Whole DocTypes are evicted in LRU order when the memory budget is exceeded and
+    reloaded when their write stamp in the store changes. A DocType larger than the whole
+    budget is kept outside of it until another such DocType replaces it, so consecutive
+    queries on it don't decode and index it again.
+    The memory of a DocType is estimated from the length of its JSON."""
+
+    # Decoded dicts take several times the size of their JSON
+    MEMORY_FACTOR = 4
+
+    def __init__(self, store: CacheStore, budget: int):
+        """
+        Args:
+            store (CacheStore): Store to load the DocTypes from
+            budget (int): Memory budget in bytes
+        """
+        self.store = store
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.size = 0
+        # (key, entry) of the last DocType larger than the budget
+        self.oversized = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.oversized_loads = 0
+
+    def get(self, doctype: str, schema: RecordSchema = None) -> list[dict]:
+        """Gets all cached entities of the given DocType, loading them if necessary."""
+        return self._get_entry(doctype, schema)["objects"]
+
+    def get_index(self, doctype: str, field: str, schema: RecordSchema = None) -> HashIndex:
+        """Gets the hash index over the given field of the given DocType, building it if necessary."""
+        return self._get_index(doctype, HashIndex, field, schema)
+
+    def get_sorted_index(self, doctype: str, field: str, schema: RecordSchema = None) -> SortedIndex:
+        """Gets the sorted index over the given field of the given DocType, building it if necessary."""
+        return self._get_index(doctype, SortedIndex, field, schema)
+
+    def get_indexes(self, doctype: str, fields: list[str], schema: RecordSchema = None) -> DocTypeIndexes:
+        """Gets the indexes of the given DocType that queries may use."""
+        return DocTypeIndexes(self, doctype, fields, schema)
+
+    def _get_index(self, doctype: str, index_class: type, field: str, schema: RecordSchema = None):
+        entry = self._get_entry(doctype, schema)
+        if (index_class, field) not in entry["indexes"]:
+            entry["indexes"][(index_class, field)] = index_class(field, entry["objects"])
+        return entry["indexes"][(index_class, field)]
+
+    def get_stats(self) -> str:
+        """Gets the counters of this cache as readable text."""
+        return (f"hits: {self.hits}, misses: {self.misses}, evictions: {self.evictions}, "
+                f"oversized_loads: {self.oversized_loads}, doctypes: {len(self.entries)}, "
+                f"memory_mb: {round(self.size / 1024 / 1024, 1)}")
+
+    def _get_entry(self, doctype: str, schema: RecordSchema = None) -> dict:
+        key = (doctype, schema.fields if schema else None)
+        stamp = self.store.get_stamp(doctype)
+        entry = self.entries.get(key, None)
+        if not entry and self.oversized and self.oversized[0] == key:
+            entry = self.oversized[1]
+        if entry and entry["stamp"] == stamp:
+            self.hits += 1
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        if key in self.entries:
+            self._remove(key)
+        elif entry:
+            self.oversized = None
+        objects, size = [], 0
+        for data in self.store.iter_raw(doctype):
+            obj = codec.loads(data)
+            if schema:
+                # Only the share of the schema's fields is kept
+                size += len(data) * len(schema.fields) // max(len(obj), 1)
+                obj = schema.compact(obj)
+            else:
+                size += len(data)
+            objects.append(obj)
+        entry = {"stamp": stamp, "objects": objects, "indexes": {}, "size": size * self.MEMORY_FACTOR}
+        if entry["size"] > self.budget:
+            self.oversized = (key, entry)
+            self.oversized_loads += 1
+            logging.getLogger(__name__).warning(
+                f"Record cache: {doctype} needs {entry['size'] // 1024 // 1024} MB, more than the budget of "
+                f"{self.budget // 1024 // 1024} MB; it is kept only until another large DocType is loaded")
+        else:
+            self.entries[key] = entry
+            self.size += entry["size"]
+            while self.size > self.budget:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return entry
+
+    def _remove(self, key: tuple):
+        self.size -= self.entries.pop(key)["size"]
+
+class CacheManifest:
+    """Keeps the state of the cache per DocType (e.g. high-water marks) in a JSON-file."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.data = json.loads(self.path.read_text(encoding="utf-8")) if self.path.exists() else {}
+
+    def get(self, doctype: str) -> dict:
+        """Gets the recorded state of the given DocType."""
+        return self.data.get(doctype, {})
+
+    def get_run(self) -> dict:
+        """Gets the recorded state of the last cache run (id, delta)."""
+        return self.data.get("_run", {})
+
+    def set_run(self, **values):
+        """Records the state of the current cache run and saves the manifest."""
+        self.data["_run"] = values
+        self.save()
+
+    def update(self, doctype: str, **values):
+        """Updates the recorded state of the given DocType and saves the manifest."""
+        self.data.setdefault(doctype, {}).update(values)
+        self.save()
+
+    def save(self):
+        """Saves the manifest atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.part")
+        tmp_path.write_text(json.dumps(self.data, indent=4), encoding="utf-8")
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,145 @@
+import codecs
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_WHITESPACE = " \t\n\r"
+_STRUCTURE = re.compile(r'["{}\[\]]')
+_STRING_END = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[,\]}\s]')
+
+def loads(data):
+    """Decodes JSON from str or bytes, using orjson if it is installed."""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumps(obj) -> str:
+    """Encodes an object as compact JSON, using orjson if it is installed."""
+    if orjson:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+def iter_array(chunks, key: str = "result"):
+    """Yields the elements of the array under the given top-level key one by one.
+    The JSON document is read incrementally from the given text or bytes chunks, so the raw
+    response is never held in full. Only the element boundaries are scanned here; every element
+    is decoded with loads() (orjson if installed). If the key is not the first key of the document
+    (it is in WeClapp responses), the document is parsed completely instead.
+
+    Args:
+        chunks (iterable): Chunks of the JSON document (e.g. response.iter_content())
+        key (str, optional): Top-level key of the array. Defaults to "result".
+    """
+    reader = _ChunkReader(chunks)
+    if not (reader.expect("{") and reader.expect(f'"{key}"') and reader.expect(":") and reader.expect("[")):
+        document = loads(reader.read_all())
+        yield from document.get(key, None) or []
+        return
+    reader.release()
+    if reader.expect("]"):
+        return
+    while True:
+        yield reader.decode()
+        if reader.expect(","):
+            continue
+        if reader.expect("]"):
+            return
+        raise ValueError(f"Malformed JSON array in '{key}'")
+
+class _ChunkReader:
+    """Buffers text of a chunked JSON document and decodes values from it."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.keep = True    # Keep consumed text until released (needed for the fallback)
+
+    def fill(self) -> bool:
+        for chunk in self.chunks:
+            text = self.utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if text:
+                if not self.keep:
+                    self.buffer, self.pos = self.buffer[self.pos:], 0
+                self.buffer += text
+                return True
+        return False
+
+    def release(self):
+        """Allows consumed text to be dropped from the buffer."""
+        self.keep = False
+
+    def read_all(self) -> str:
+        while self.fill():
+            pass
+        return self.buffer
+
+    def skip_whitespace(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return
+
+    def expect(self, text: str) -> bool:
+        """Consumes the given text if it follows (after whitespace)."""
+        self.skip_whitespace()
+        while len(self.buffer) - self.pos < len(text) and self.fill():
+            pass
+        if self.buffer.startswith(text, self.pos):
+            self.pos += len(text)
+            return True
+        return False
+
+    def decode(self):
+        """Decodes the next JSON value, reading more chunks until it is complete."""
+        self.skip_whitespace()
+        end = self._scan()
+        value = loads(self.buffer[self.pos:end])
+        self.pos = end
+        return value
+
+    def _scan(self) -> int:
+        """Finds the end of the JSON value at the read position.
+        Scanning resumes where it stopped when more chunks are needed. Offsets are relative to
+        the read position, since fill() may drop the consumed text before it."""
+        offset, depth, in_string = 0, 0, False
+        if self.pos < len(self.buffer) and self.buffer[self.pos] not in '{["':
+            # Scalar: ends at the next delimiter (or the end of the document)
+            while True:
+                match = _SCALAR_END.search(self.buffer, self.pos)
+                if match:
+                    return match.start()
+                if not self.fill():
+                    return len(self.buffer)
+        while True:
+            if in_string:
+                match = _STRING_END.search(self.buffer, self.pos + offset)
+            else:
+                match = _STRUCTURE.search(self.buffer, self.pos + offset)
+            if match is None:
+                offset = max(offset, len(self.buffer) - self.pos)
+                if not self.fill():
+                    raise ValueError("Unexpected end of JSON document")
+                continue
+            char = match.group()
+            offset = match.end() - self.pos
+            if char == "\\":
+                # Skip the escaped character
+                offset += 1
+            elif char == '"':
+                in_string = not in_string
+                if not in_string and depth == 0:
+                    return self.pos + offset
+            elif char in "{[":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return self.pos + offset
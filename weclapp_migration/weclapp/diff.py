@@ -0,0 +1,36 @@
+from .snapshot import SnapshotStore
+
+class SnapshotDiff:
+    """Changes of a DocType between two snapshots, as sets of WeClapp-IDs."""
+
+    def __init__(self, doctype: str, added: set[str], changed: set[str], removed: set[str]):
+        self.doctype = doctype
+        self.added = added
+        self.changed = changed
+        self.removed = removed
+
+    def get_ids(self) -> set[str]:
+        """Gets the IDs of the added and changed entities, i.e. the entities to migrate again."""
+        return self.added | self.changed
+
+    def __repr__(self) -> str:
+        return f"{self.doctype}: added {len(self.added)}, changed {len(self.changed)}, removed {len(self.removed)}"
+
+def diff_snapshots(old: SnapshotStore, new: SnapshotStore, doctype: str) -> SnapshotDiff:
+    """Compares the entities of the given DocType in two snapshots by ID and content hash.
+    Only the snapshot indexes are read, the entities are not decoded.
+
+    Args:
+        old (SnapshotStore): Older snapshot (None if there is none, then everything is added)
+        new (SnapshotStore): Newer snapshot
+        doctype (str): WeClapp-DocType
+
+    Returns:
+        SnapshotDiff: Added, changed and removed IDs
+    """
+    old_hashes = old.get_hashes(doctype) if old else {}
+    new_hashes = new.get_hashes(doctype)
+    added = {id for id in new_hashes if id not in old_hashes}
+    removed = {id for id in old_hashes if id not in new_hashes}
+    changed = {id for id, sha1 in new_hashes.items() if id in old_hashes and old_hashes[id] != sha1}
+    return SnapshotDiff(doctype, added, changed, removed)
@@ -0,0 +1,80 @@
+import hashlib
+import os
+import threading
+from pathlib import Path
+from queue import Queue
+
+class DocumentDownloader:
+    """Downloads WeClapp documents to disk in background threads.
+    Bodies are streamed in chunks to a temporary file which is renamed atomically when complete.
+    The content is hashed while streaming and handed to an optional completion callback.
+    The queue is bounded, so submitting blocks while all workers are busy."""
+
+    def __init__(self, api, workers: int, queue_size: int, chunk_size: int):
+        self.api = api
+        self.chunk_size = chunk_size
+        self.queue = Queue(maxsize=queue_size)
+        self.errors = []
+        self.errors_lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, name=f"weclapp-download-{i}", daemon=True)
+                        for i in range(workers)]
+
+    def __enter__(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, document_id: str, path: Path, on_complete = None):
+        """Queues the download of the given document to the given path.
+
+        Args:
+            document_id (str): WeClapp-ID of the document
+            path (Path): Path to save the document to
+            on_complete (callable, optional): Called with path, SHA-256 and size after the download. Defaults to None.
+        """
+        self.queue.put((document_id, Path(path), on_complete))
+
+    def close(self) -> list[str]:
+        """Waits for all queued downloads to finish and stops the workers.
+
+        Returns:
+            list: Error messages of failed downloads
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        return self.errors
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            document_id, path, on_complete = item
+            try:
+                sha256, size = self._download(document_id, path)
+                if on_complete:
+                    on_complete(path, sha256, size)
+            except Exception as e:
+                with self.errors_lock:
+                    self.errors.append(f"Document {document_id} ({path.name}): {e}")
+
+    def _download(self, document_id: str, path: Path) -> tuple[str, int]:
+        tmp_path = path.with_name(f"{path.name}.part")
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            with self.api._request(f"document/id/{document_id}/download", "GET", stream=True) as response, \
+                    open(tmp_path, "wb") as file:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    file.write(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return sha256.hexdigest(), size
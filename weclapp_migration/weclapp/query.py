@@ -0,0 +1,181 @@
+import zlib
+from abc import ABC, abstractmethod
+
+class Query(ABC):
+    """Declarative filter for cached entities.
+    Queries can be combined with & and |. The cache plans them against its indexes:
+    every query returns candidate entities from an index if it can, which are then
+    checked with match()."""
+
+    @abstractmethod
+    def match(self, obj: dict) -> bool:
+        """Checks whether the entity matches the query."""
+        pass
+
+    def candidates(self, indexes) -> tuple[list[dict], str]:
+        """Gets the candidate entities from the indexes.
+
+        Args:
+            indexes (DocTypeIndexes): Indexes of the queried DocType
+
+        Returns:
+            tuple: Candidate entities and description of the used index, or (None, None) for a full scan
+        """
+        return None, None
+
+    def __and__(self, other: "Query") -> "Query":
+        return And(self, other)
+
+    def __or__(self, other: "Query") -> "Query":
+        return Or(self, other)
+
+class Eq(Query):
+    """Field equals the value."""
+
+    def __init__(self, field: str, value):
+        self.field = field
+        self.value = value
+
+    def match(self, obj: dict) -> bool:
+        return obj.get(self.field, None) == self.value
+
+    def candidates(self, indexes) -> tuple[list[dict], str]:
+        index = indexes.hash(self.field)
+        if index is None:
+            return None, None
+        return index.get(self.value), f"hash index on {self.field}"
+
+    def __repr__(self) -> str:
+        return f"{self.field} == {self.value!r}"
+
+class In(Query):
+    """Field equals one of the values."""
+
+    def __init__(self, field: str, values):
+        self.field = field
+        self.values = set(values)
+
+    def match(self, obj: dict) -> bool:
+        return obj.get(self.field, None) in self.values
+
+    def candidates(self, indexes) -> tuple[list[dict], str]:
+        index = indexes.hash(self.field)
+        if index is None:
+            return None, None
+        return [obj for value in self.values for obj in index.get(value)], f"hash index on {self.field}"
+
+    def __repr__(self) -> str:
+        return f"{self.field} in {len(self.values)} values"
+
+class Range(Query):
+    """Field lies in the range given by the bounds (None for open bounds). Entities without a value never match."""
+
+    def __init__(self, field: str, gt = None, gte = None, lt = None, lte = None):
+        self.field = field
+        self.gt = gt
+        self.gte = gte
+        self.lt = lt
+        self.lte = lte
+
+    def match(self, obj: dict) -> bool:
+        value = obj.get(self.field, None)
+        return value is not None \
+            and (self.gt is None or value > self.gt) \
+            and (self.gte is None or value >= self.gte) \
+            and (self.lt is None or value < self.lt) \
+            and (self.lte is None or value <= self.lte)
+
+    def candidates(self, indexes) -> tuple[list[dict], str]:
+        index = indexes.sorted(self.field)
+        if index is None:
+            return None, None
+        return index.range(self.gt, self.gte, self.lt, self.lte), f"sorted index on {self.field}"
+
+    def __repr__(self) -> str:
+        bounds = [f"{op} {value!r}" for op, value in
+                  ((">", self.gt), (">=", self.gte), ("<", self.lt), ("<=", self.lte)) if value is not None]
+        return f"{self.field} {' and '.join(bounds)}"
+
+class And(Query):
+    """All queries match. Uses the index of the part with the fewest candidates."""
+
+    def __init__(self, *queries: Query):
+        self.queries = queries
+
+    def match(self, obj: dict) -> bool:
+        return all(query.match(obj) for query in self.queries)
+
+    def candidates(self, indexes) -> tuple[list[dict], str]:
+        best, best_index = None, None
+        for query in self.queries:
+            objects, index = query.candidates(indexes)
+            if objects is not None and (best is None or len(objects) < len(best)):
+                best, best_index = objects, index
+        return best, best_index
+
+    def __repr__(self) -> str:
+        return "(" + " & ".join(repr(query) for query in self.queries) + ")"
+
+class Or(Query):
+    """Any query matches. Only uses indexes if every part can use one."""
+
+    def __init__(self, *queries: Query):
+        self.queries = queries
+
+    def match(self, obj: dict) -> bool:
+        return any(query.match(obj) for query in self.queries)
+
+    def candidates(self, indexes) -> tuple[list[dict], str]:
+        result, seen, used = [], set(), []
+        for query in self.queries:
+            objects, index = query.candidates(indexes)
+            if objects is None:
+                return None, None
+            used.append(index)
+            for obj in objects:
+                if id(obj) not in seen:
+                    seen.add(id(obj))
+                    result.append(obj)
+        return result, " | ".join(dict.fromkeys(used))
+
+    def __repr__(self) -> str:
+        return "(" + " | ".join(repr(query) for query in self.queries) + ")"
+
+class Shard(Query):
+    """Field hashes to the given shard (CRC32 of the value modulo the shard count).
+    Splits the entities into disjoint partitions that are stable across runs and workers."""
+
+    def __init__(self, field: str, shard: int, shards: int):
+        self.field = field
+        self.shard = shard
+        self.shards = shards
+
+    def match(self, obj: dict) -> bool:
+        return get_shard(obj.get(self.field, None), self.shards) == self.shard
+
+    def __repr__(self) -> str:
+        return f"{self.field} in shard {self.shard}/{self.shards}"
+
+class Where(Query):
+    """Arbitrary filter function. Always scans all entities."""
+
+    def __init__(self, function):
+        self.function = function
+
+    def match(self, obj: dict) -> bool:
+        return self.function(obj)
+
+    def __repr__(self) -> str:
+        return f"where {getattr(self.function, '__name__', 'function')}"
+
+def as_query(query) -> Query:
+    """Converts a filter (query, dict of field values or function) into a query."""
+    if query is None or isinstance(query, Query):
+        return query
+    if isinstance(query, dict):
+        return And(*[Eq(field, value) for field, value in query.items()])
+    return Where(query)
+
+def get_shard(value, shards: int) -> int:
+    """Gets the shard of the given value."""
+    return zlib.crc32(str(value).encode("utf-8")) % shards
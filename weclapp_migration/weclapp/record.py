@@ -0,0 +1,40 @@
+from collections.abc import Mapping
+
+class RecordSchema:
+    """Key layout shared by all compact records of a DocType."""
+
+    def __init__(self, fields: list[str]):
+        self.fields = tuple(dict.fromkeys(fields))
+        self.positions = {field: i for i, field in enumerate(self.fields)}
+
+    @classmethod
+    def from_properties(cls, properties: list[str]) -> "RecordSchema":
+        """Creates the schema for the given properties. Dotted paths keep their complete top-level field."""
+        return cls(["id", *[property.split(".", 1)[0] for property in properties]])
+
+    def compact(self, obj: dict) -> "CompactRecord":
+        """Creates a compact record with the schema's fields of the given entity."""
+        return CompactRecord(self, tuple(obj.get(field, None) for field in self.fields))
+
+class CompactRecord(Mapping):
+    """Read-only entity that stores only the values of its schema's fields in a tuple.
+    The keys are shared by all records of the schema, so a record takes a fraction of the memory of a dict.
+    Supports the read access of a dict (get, [], in, items, ...)."""
+
+    __slots__ = ("schema", "_values")
+
+    def __init__(self, schema: RecordSchema, values: tuple):
+        self.schema = schema
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self.schema.positions[key]]
+
+    def __iter__(self):
+        return iter(self.schema.fields)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __repr__(self) -> str:
+        return f"CompactRecord({dict(self)!r})"
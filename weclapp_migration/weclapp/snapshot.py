@@ -0,0 +1,216 @@
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import shutil
+from pathlib import Path
+from . import codec
+
+class SnapshotWriter:
+    """Writes the entities of a DocType as a snapshot: JSON Lines chunks plus a sidecar index.
+    The index maps every ID to its chunk, the offset and length of its line in the
+    uncompressed chunk and the SHA-1 of the line. The snapshot is written to a temporary
+    folder and replaces the previous snapshot of the DocType when it is complete."""
+
+    def __init__(self, base: str, doctype: str, chunk_records: int = 50000, compress: bool = True):
+        """
+        Args:
+            base (str): Folder of the snapshots
+            doctype (str): WeClapp-DocType
+            chunk_records (int, optional): Entities per chunk. Defaults to 50000.
+            compress (bool, optional): Compress the chunks with gzip. Defaults to True.
+        """
+        self.path = Path(base).joinpath(doctype)
+        self.tmp_path = Path(base).joinpath(f"{doctype}.part")
+        self.chunk_records = chunk_records
+        self.compress = compress
+        self.index = {}
+        self.chunk = -1
+        self.file = None
+        self.records = 0
+        self.offset = 0
+
+    def __enter__(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        self.tmp_path.mkdir(parents=True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.file:
+            self.file.close()
+        if exc_type:
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+            return
+        self.tmp_path.joinpath("index.json").write_text(json.dumps(self.index), encoding="utf-8")
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+
+    def add(self, id: str, data: str):
+        """Appends the entity with the given ID and JSON to the snapshot."""
+        if self.file is None or self.records >= self.chunk_records:
+            self._next_chunk()
+        line = data.encode("utf-8") + b"\n"
+        self.file.write(line)
+        self.index[str(id)] = [self.chunk, self.offset, len(line) - 1, hashlib.sha1(line).hexdigest()]
+        self.offset += len(line)
+        self.records += 1
+
+    def _next_chunk(self):
+        if self.file:
+            self.file.close()
+        self.chunk += 1
+        path = self.tmp_path.joinpath(chunk_name(self.chunk, self.compress))
+        self.file = gzip.open(path, "wb", compresslevel=6) if self.compress else open(path, "wb")
+        self.records = 0
+        self.offset = 0
+
+def chunk_name(chunk: int, compress: bool) -> str:
+    return f"{chunk:05d}.jsonl.gz" if compress else f"{chunk:05d}.jsonl"
+
+def link_snapshot(source: str, target: str, doctype: str):
+    """Adds the snapshot of the given DocType in the source folder to the target folder without writing it again.
+    The files are hard linked (copied if the file system doesn't support it). Snapshots are never changed
+    in place, only replaced, so the linked files stay valid."""
+    source_path = Path(source).joinpath(doctype)
+    path = Path(target).joinpath(doctype)
+    tmp_path = Path(target).joinpath(f"{doctype}.part")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    for file in source_path.iterdir():
+        try:
+            os.link(file, tmp_path.joinpath(file.name))
+        except OSError:
+            shutil.copyfile(file, tmp_path.joinpath(file.name))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+class SnapshotStore:
+    """Read access to the snapshots of the cache.
+    Entities are streamed chunk by chunk or looked up by ID through the sidecar index.
+    Uncompressed chunks are read via memory mapping, compressed chunks are
+    decompressed once and kept until another chunk is needed."""
+
+    def __init__(self, base: str):
+        self.base = Path(base)
+        self.indexes = {}
+        self.maps = {}
+        self.last_chunk = (None, None)
+
+    def close(self, doctype: str = None):
+        """Closes the mapped chunks of the given DocType (None for all)."""
+        for path in [path for path in self.maps if doctype is None or path.parent.name == doctype]:
+            file, data = self.maps.pop(path)
+            data.close()
+            file.close()
+        self.last_chunk = (None, None)
+
+    def exists(self, doctype: str) -> bool:
+        return self.base.joinpath(doctype, "index.json").exists()
+
+    def get_stamp(self, doctype: str) -> int:
+        """Gets the modification time of the snapshot of the given DocType."""
+        index_path = self.base.joinpath(doctype, "index.json")
+        return index_path.stat().st_mtime_ns if index_path.exists() else None
+
+    def get(self, doctype: str, id: str) -> dict:
+        """Gets the entity of the given DocType and ID through the index."""
+        entry = self._get_index(doctype).get(str(id), None)
+        if not entry:
+            return None
+        chunk, offset, length, _ = entry
+        return codec.loads(self._read_chunk(doctype, chunk)[offset:offset + length])
+
+    def get_all(self, doctype: str):
+        """Yields all entities of the given DocType."""
+        for data in self.iter_raw(doctype):
+            yield codec.loads(data)
+
+    def get_ids(self, doctype: str) -> list[str]:
+        return list(self._get_index(doctype))
+
+    def get_hashes(self, doctype: str) -> dict[str, str]:
+        """Gets the SHA-1 of every entity of the given DocType by ID."""
+        return {id: entry[3] for id, entry in self._get_index(doctype).items()}
+
+    def iter_raw(self, doctype: str):
+        """Yields the JSON of all entities of the given DocType without decoding it."""
+        path = self.base.joinpath(doctype)
+        if not self.exists(doctype):
+            return
+        for chunk_path in sorted(path.glob("*.jsonl*")):
+            if chunk_path.suffix == ".gz":
+                with gzip.open(chunk_path, "rb") as file:
+                    for line in file:
+                        yield line.rstrip(b"\n")
+            elif chunk_path.stat().st_size:
+                with open(chunk_path, "rb") as file, \
+                        mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    start = 0
+                    while start < len(data):
+                        end = data.find(b"\n", start)
+                        yield data[start:end]
+                        start = end + 1
+
+    def _get_index(self, doctype: str) -> dict:
+        stamp = self.get_stamp(doctype)
+        if stamp is None:
+            return {}
+        if doctype not in self.indexes or self.indexes[doctype][0] != stamp:
+            # A new snapshot replaces the chunks, so mapped and decompressed chunks are stale
+            self.close(doctype)
+            index = json.loads(self.base.joinpath(doctype, "index.json").read_text(encoding="utf-8"))
+            self.indexes[doctype] = (stamp, index)
+        return self.indexes[doctype][1]
+
+    def _read_chunk(self, doctype: str, chunk: int):
+        path = self.base.joinpath(doctype, chunk_name(chunk, False))
+        if path.exists():
+            return self._map(path)
+        path = self.base.joinpath(doctype, chunk_name(chunk, True))
+        if self.last_chunk[0] != path:
+            with gzip.open(path, "rb") as file:
+                self.last_chunk = (path, file.read())
+        return self.last_chunk[1]
+
+    def _map(self, path: Path):
+        if path not in self.maps:
+            file = open(path, "rb")
+            if os.fstat(file.fileno()).st_size == 0:
+                file.close()
+                return b""
+            self.maps[path] = (file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        return self.maps[path][1]
+
+class Generations:
+    """Snapshots of completed cache runs, one folder per generation (named by its timestamp).
+    Only the newest generations are kept."""
+
+    def __init__(self, base: str, keep: int):
+        self.base = Path(base)
+        self.keep = keep
+
+    def list(self) -> list[str]:
+        """Gets the names of the complete generations, oldest first."""
+        if not self.base.exists():
+            return []
+        return sorted(path.name for path in self.base.iterdir() if path.is_dir() and not path.name.endswith(".part"))
+
+    def get_path(self, name: str) -> Path:
+        return self.base.joinpath(name)
+
+    def open(self, name: str) -> SnapshotStore:
+        return SnapshotStore(self.get_path(name))
+
+    def clear_unfinished(self, keep: str = None):
+        """Removes unfinished generations of interrupted runs except the given one."""
+        if not self.base.exists():
+            return
+        for path in self.base.glob("*.part"):
+            if path.name != keep:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def prune(self):
+        """Removes all generations but the newest ones."""
+        for name in self.list()[:-self.keep] if self.keep > 0 else self.list():
+            shutil.rmtree(self.get_path(name), ignore_errors=True)
@@ -0,0 +1,85 @@
+import threading
+import time
+
+class AdaptiveRateLimiter:
+    """Token bucket limiting the request rate to the WeClapp API.
+    The rate adapts to the server's responses: it grows additively while requests succeed
+    and is halved whenever the server signals overload (AIMD)."""
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float, increase: float = 0.5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Takes a token, waiting until one is available.
+
+        Returns:
+            float: Seconds waited for the token
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def on_success(self):
+        """Raises the rate after a successful request."""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / max(self.rate, 1.0))
+
+    def on_throttle(self):
+        """Halves the rate after the server signalled overload."""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+class CircuitOpenError(Exception):
+    """Raised when a request is refused because the circuit breaker is open."""
+    pass
+
+class CircuitBreaker:
+    """Stops sending requests after too many consecutive failures.
+    After the reset timeout a single trial request is let through (half-open);
+    its outcome closes the circuit again or reopens it."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        """Checks whether a request may be sent.
+
+        Raises:
+            CircuitOpenError: The circuit is open
+        """
+        with self.lock:
+            if self.opened is None:
+                return
+            if self.trial or time.monotonic() - self.opened < self.reset_timeout:
+                raise CircuitOpenError(f"WeClapp API unavailable after {self.failures} consecutive failures")
+            self.trial = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                self.opened = time.monotonic()
+            self.trial = False
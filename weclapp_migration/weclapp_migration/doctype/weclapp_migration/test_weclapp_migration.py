@@ -1,9 +1,44 @@
 # Copyright (c) 2023, PC-Giga (Florian Glashauser) and Contributors
 # See license.txt
 
-# import frappe
+import frappe
+from unittest import mock
 from frappe.tests.utils import FrappeTestCase
+from ....migration.contact import ContactMigration
+from ....tools.data import get_content_hash
+from ....tools.transaction import TransactionPolicy
+
+
+def note(text: str) -> "frappe.Document":
+	return frappe.get_doc({"doctype": "CRM Note", "wc_id": "1", "note": text})
 
 
 class TestWeclappMigration(FrappeTestCase):
-	pass
+	def test_content_hash_of_notes(self):
+		"""Notes are hashed by their content, so a changed note of a lead is migrated again."""
+		self.assertEqual(get_content_hash({"notes": [note("Call back")]}), get_content_hash({"notes": [note("Call back")]}))
+		self.assertNotEqual(get_content_hash({"notes": [note("Call back")]}), get_content_hash({"notes": [note("Don't call")]}))
+
+	def test_content_hash_ignores_volatile_fields(self):
+		changed = note("Call back")
+		changed.name = "abc123"
+		changed.modified = frappe.utils.now()
+		self.assertEqual(get_content_hash([changed]), get_content_hash([note("Call back")]))
+
+	def test_failed_nested_entity_is_migrated_again(self):
+		"""A contact whose address failed gets no hash, so it isn't skipped until the address is migrated."""
+		api = frappe._dict(identity_maps={}, transaction=TransactionPolicy(1))
+		migration = ContactMigration(api)
+		migration.get_identity_map().add("1", "Contact-1")
+		wc_obj = {"id": "1", "addresses": [{"id": "2"}]}
+		en_doc = frappe._dict(name="Contact-1")
+		en_doc.db_set = lambda field, value, update_modified: en_doc.update({field: value})
+		with mock.patch.object(ContactMigration, "get_hash", return_value="hash"):
+			migration._store_hash(en_doc, wc_obj)
+			self.assertIsNone(en_doc.wc_hash)
+			self.assertFalse(migration.is_unchanged(wc_obj))
+
+			migration.get_identity_map("Address").add("2", "Address-2", "address-hash")
+			migration._store_hash(en_doc, wc_obj)
+			self.assertEqual(en_doc.wc_hash, "hash")
+			self.assertTrue(migration.is_unchanged(wc_obj))
@@ -8,17 +8,55 @@ frappe.ui.form.on("Weclapp Migration", {
             frappe.msgprint(__("Caching all WeClapp Data. This may take a while. Please watch the logs for progress.") +
                 __(' <a href="/app/weclapp-migration-log">Click here</a> to view the Weclapp Migration Log'));
         });
+        frm.add_custom_button(__("Update cached WeClapp Data"), function() {
+            frm.call('cache_weclapp_data', {delta: 1});
+            frappe.msgprint(__("Fetching WeClapp Data changed since the last caching run. Please watch the logs for progress.") +
+                __(' <a href="/app/weclapp-migration-log">Click here</a> to view the Weclapp Migration Log'));
+        });
+        frm.add_custom_button(__("Resume caching"), function() {
+            frm.call('resume_caching').then(() => {
+                frappe.msgprint(__("Resuming the last cache run from its checkpoints. Please watch the logs for progress.") +
+                    __(' <a href="/app/weclapp-migration-log">Click here</a> to view the Weclapp Migration Log'));
+            });
+        });
         frm.add_custom_button(__("Migrate selected Data"), function() {
             //frm.save();
             frm.call('migrate_weclapp_data');
             frappe.msgprint(__("Migrates selected WeClapp Data (should be cached before). This may take a while. Please watch the logs for progress.") +
                 __(' <a href="/app/weclapp-migration-log">Click here</a> to view the Weclapp Migration Log'));
         });
+        frm.add_custom_button(__("Migrate selected Data in parallel"), function() {
+            frm.call('migrate_weclapp_data', {sharded: 1});
+            frappe.msgprint(__("Migrates selected WeClapp Data in parallel shard jobs; independent DocTypes run at the same time. Please watch the logs for progress.") +
+                __(' <a href="/app/weclapp-migration-log">Click here</a> to view the Weclapp Migration Log'));
+        });
+        if ((frm.doc.__onload || {}).cache_generations) {
+            frm.add_custom_button(__("Migrate changed Data"), function() {
+                frm.call('migrate_weclapp_data', {changed_only: 1}).then(() => {
+                    frappe.msgprint(__("Migrates selected WeClapp Data added or changed since the previous caching run. Please watch the logs for progress.") +
+                        __(' <a href="/app/weclapp-migration-log">Click here</a> to view the Weclapp Migration Log'));
+                });
+            });
+        }
         frm.add_custom_button(__("Clear migrated Data"), function() {
             //frm.save();
             frm.call('clear_migrated_data');
-            frappe.msgprint(__("Clears selected migrated WeClapp Data. This may take a while. Please watch the logs for progress.") +
+            frappe.msgprint(__("Clears selected migrated Leads, Customers and Opportunities; master data is kept. This may take a while. Please watch the logs for progress.") +
                 __(' <a href="/app/weclapp-migration-log">Click here</a> to view the Weclapp Migration Log'));
         });
+        frm.add_custom_button(__("Check wc_id Indexes"), function() {
+            frm.call('check_wc_id_indexes').then((r) => {
+                let missing = r.message || [];
+                if (!missing.length) {
+                    frappe.msgprint(__("All migrated DocTypes have an index on wc_id."));
+                    return;
+                }
+                frappe.confirm(__("These DocTypes have no index on wc_id: {0}. Add the indexes now?", [missing.join(", ")]), () => {
+                    frm.call('check_wc_id_indexes', {fix: 1}).then((r) => {
+                        frappe.msgprint(__("Added wc_id indexes to: {0}", [(r.message || []).join(", ")]));
+                    });
+                });
+            });
+        });
 	},
 });
\ No newline at end of file
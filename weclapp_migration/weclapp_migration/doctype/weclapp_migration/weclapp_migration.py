@@ -2,9 +2,15 @@
 # For license information, please see license.txt
 
 import frappe
+import time
 from datetime import datetime
 from frappe.model.document import Document
-from ....weclapp.api import Api
+from frappe.utils import cint
+from ....weclapp.api import Api, CacheDeadlineError
+from ....weclapp.query import In, Shard
+from ....tools.barrier import Barrier
+from ....migration.scheduler import DependencyCycleError, MigrationScheduler
+from ....install import ensure_wc_id_indexes, get_missing_wc_id_indexes
 from ....migration.customer import CustomerMigration
 from ....migration.industry_type import IndustryTypeMigration
 from ....migration.market_segment import MarketSegmentMigration
@@ -17,86 +23,216 @@ from ....migration.user import UserMigration
 from ....migration.sales_stage import SalesStageMigration
 from ....migration.opportunity import OpportunityMigration
 
+CACHE_JOB_TIMEOUT = 5000
+
+# Checkbox field of the DocType -> migration
+MIGRATIONS = {
+	"sales_stage": SalesStageMigration,
+	"user": UserMigration,
+	"uom": UomMigration,
+	"salutation": SalutationMigration,
+	"industry_type": IndustryTypeMigration,
+	"market_segment": MarketSegmentMigration,
+	"lead_source": LeadSourceMigration,
+	"item": ItemMigration,
+	"lead": LeadMigration,
+	"customer": CustomerMigration,
+	"opportunity": OpportunityMigration
+}
+
+MIGRATIONS_BY_NAME = {migration.__name__: migration for migration in MIGRATIONS.values()}
+
 class WeclappMigration(Document):
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 		self.config = frappe.get_single("Weclapp Migration Settings")
 
+	def onload(self):
+		# The form only offers migrating changed data if cache generations are kept
+		self.set_onload("cache_generations", self.config.wc_cache_generations)
+
 	@frappe.whitelist()
-	def cache_weclapp_data(self):
-		"""Caches all data from WeClapp to local cache-database (JSON-files).
+	def cache_weclapp_data(self, delta=False):
+		"""Caches all data from WeClapp to the local cache-database (SQLite).
+		In delta mode only entities modified since the last run are fetched and merged.
 		"""
 		frappe.enqueue_doc(
 			"Weclapp Migration",
 			self.name,
 			"cache_weclapp_data_job",
 			queue="long",
-			timeout=5000
+			timeout=CACHE_JOB_TIMEOUT,
+			delta=cint(delta)
 		)
 		#self.cache_weclapp_data_job()
 
-	def cache_weclapp_data_job(self):
+	@frappe.whitelist()
+	def resume_caching(self):
+		"""Resumes the last cache run from its checkpoints."""
 		with Api() as api:
-			api.setup_cache()
+			run = api.manifest.get_run()
+		if not run or run.get("finished", False):
+			frappe.throw("There is no unfinished cache run to resume.")
+		frappe.enqueue_doc(
+			"Weclapp Migration",
+			self.name,
+			"cache_weclapp_data_job",
+			queue="long",
+			timeout=CACHE_JOB_TIMEOUT,
+			delta=run.get("delta", False),
+			run_id=run.get("id", None)
+		)
+
+	def cache_weclapp_data_job(self, delta=False, run_id=None):
+		"""Caches all DocTypes. If a run ID is given, the run continues from its checkpoints:
+		completed DocTypes are skipped and the others continue after their last finished page.
+		Shortly before the job timeout the job stops at a checkpoint and re-enqueues itself."""
+		with Api() as api:
+			api.deadline = time.monotonic() + CACHE_JOB_TIMEOUT - self.config.wc_job_timeout_margin
+			if not run_id:
+				run_id = frappe.generate_hash(length=10)
+				api.setup_cache(delta)
+				api.manifest.set_run(id=run_id, delta=delta, finished=False)
+			projections = self._get_projections(api) if self.config.wc_use_projection else {}
 			for doctype in self.config.wc_doctypes:
+				if api.manifest.get(doctype).get("run", None) == run_id:
+					continue
 				try:
-					api.cache_doctype(doctype)
+					api.cache_doctype(doctype, delta, projections.get(doctype, None), run_id)
 					api.log("Success", f"Successfully cached: {doctype}")
+				except CacheDeadlineError:
+					api.log("Success", f"Caching paused at {doctype} before the job timeout, continuing in a new job")
+					self._continue_caching(delta, run_id)
+					return
 				except Exception as e:
 					api.log("Error", f"Error while caching {doctype}", f"{e}")
+			try:
+				if self.config.wc_cache_backend == "snapshot":
+					api.write_snapshots()
+					api.log("Success", "Successfully written cache snapshots")
+				if self.config.wc_cache_generations:
+					api.log("Success", f"Saved cache generation {api.create_generation(run_id)}")
+			except CacheDeadlineError:
+				api.log("Success", "Writing snapshots paused before the job timeout, continuing in a new job")
+				self._continue_caching(delta, run_id)
+				return
+			api.manifest.set_run(id=run_id, delta=delta, finished=True)
+			api.log("Success", f"Request statistics: {api.get_stats()}")
 
-	@frappe.whitelist()
-	def migrate_weclapp_data(self):
-		"""Migrates selected data from Cache to ERPNext."""
+	def _continue_caching(self, delta, run_id):
+		"""Enqueues a new job continuing the given cache run from its checkpoints."""
 		frappe.enqueue_doc(
 			"Weclapp Migration",
 			self.name,
-			"migrate_weclapp_data_job",
+			"cache_weclapp_data_job",
 			queue="long",
-			timeout=5000
+			timeout=CACHE_JOB_TIMEOUT,
+			delta=delta,
+			run_id=run_id
 		)
-		#self.migrate_weclapp_data_job()
 
-	def migrate_weclapp_data_job(self):
+	def _get_projections(self, api: Api) -> dict:
+		"""Gets the WeClapp properties to fetch per DocType, as declared by the migrations.
+		DocTypes not used by any migration are fetched completely."""
+		projections = {}
+		for migration in MIGRATIONS.values():
+			for doctype, properties in migration(api).get_wc_projections().items():
+				if properties is None or (doctype in projections and projections[doctype] is None):
+					projections[doctype] = None
+				else:
+					projections[doctype] = list(dict.fromkeys([*projections.get(doctype, []), *properties]))
+		return projections
+
+	@frappe.whitelist()
+	def migrate_weclapp_data(self, changed_only=False, sharded=False):
+		"""Migrates the selected DocTypes from Cache to ERPNext.
+		Every migration runs as its own job as soon as the migrations it depends on are done,
+		so independent migrations run concurrently.
+		If changed_only is set, only entities added or changed in the last cache generation are migrated.
+		If sharded is set, every migration is additionally split into parallel shard jobs.
+		"""
+		scheduler = self._get_scheduler()
+		run_id = frappe.generate_hash(length=10)
+		shards = self.config.wc_migration_shards if cint(sharded) else 1
 		with Api() as api:
-			industryTypeMig = IndustryTypeMigration(api)
-			marketSegmentMig = MarketSegmentMigration(api)
-			leadSourceMig = LeadSourceMigration(api)
-			customerMigration = CustomerMigration(api)
-			leadMigration = LeadMigration(api)
-			salutationMigration = SalutationMigration(api)
-			uomMig = UomMigration(api)
-			itemMig = ItemMigration(api)
-			userMig = UserMigration(api)
-			opportunityMig = OpportunityMigration(api)
-			salesStageMig = SalesStageMigration(api)
-
-
-			# salesStageMig.migrate()
-			# userMig.migrate()
-			# uomMig.migrate()
-			# salutationMigration.migrate()
-			# industryTypeMig.migrate()
-			# marketSegmentMig.migrate()
-			# leadSourceMig.migrate()
-			# itemMig.migrate()
-			leadMigration.migrate()
-			# customerMigration.migrate()
-			# opportunityMig.migrate()
-
-
-			#customerMigration.migrate()
-			#leadMigration.migrate()
-			# test_doc = frappe.get_doc({	"doctype": "Customer", "name": "14104"})
-			# test_doc.load_from_db()
-			# print(test_doc)
-			#leadMigration.migrate(query=lambda x: x["leadNumber"] == "23073")
-			#customerMigration.migrate(lambda x: x["customerNumber"] == "13977")
-			#opportunityMig.migrate(lambda x: x["opportunityNumber"] == "1001")
+			if cint(changed_only) and not api.generations.list():
+				frappe.throw("There is no cache generation to compare. Please enable cache generations "
+					"(wc_cache_generations) and cache the WeClapp Data first.")
+			api.log("Success", f"Migrating {', '.join(scheduler.get_order())} "
+				f"(critical path: {' -> '.join(scheduler.get_critical_path())})")
+		self._enqueue_ready(scheduler, run_id, shards, cint(changed_only))
+
+	def _get_scheduler(self) -> MigrationScheduler:
+		"""Gets the dependency graph of the selected migrations."""
+		try:
+			return MigrationScheduler(self._get_selected_migrations())
+		except DependencyCycleError as e:
+			frappe.throw(f"{e}")
+
+	def _get_selected_migrations(self) -> list:
+		return [migration for field, migration in MIGRATIONS.items() if cint(self.get(field))]
+
+	def _get_query(self, api: Api, migration, changed_only=False, log=True):
+		"""Gets the query of the entities to migrate: all (None) or the ones added or changed
+		since the previous cache generation."""
+		if not changed_only:
+			return None
+		diff = api.diff_generations(migration.wc_doctype)
+		if log:
+			api.log("Success", f"Changes since the previous cache generation: {diff}")
+		return In("id", diff.get_ids())
+
+	def _enqueue_ready(self, scheduler: MigrationScheduler, run_id, shards, changed_only=False):
+		"""Enqueues the shard jobs of all migrations whose dependencies are done.
+		Every migration is claimed once, so concurrently finishing jobs don't enqueue it twice."""
+		done = {name for name in scheduler.get_order() if Barrier(f"{run_id}:{name}", shards).get_arrived() >= shards}
+		for name in scheduler.get_ready(done):
+			if not Barrier(f"{run_id}:{name}:claimed", 1).arrive():
+				continue
+			for shard in range(shards):
+				frappe.enqueue_doc(
+					"Weclapp Migration",
+					self.name,
+					"migrate_shard_job",
+					queue="long",
+					timeout=5000,
+					run_id=run_id,
+					migrations=scheduler.get_order(),
+					migration=name,
+					shard=shard,
+					shards=shards,
+					changed_only=changed_only
+				)
+		return done
+
+	def migrate_shard_job(self, run_id, migrations, migration, shard, shards, changed_only=False):
+		"""Migrates the entities of one shard (by hash of the WeClapp-ID) of a migration.
+		The last shard to finish enqueues the migrations that depended on it."""
+		with Api() as api:
+			mig = MIGRATIONS_BY_NAME[migration](api)
+			try:
+				query = self._get_query(api, mig, changed_only, log=shard == 0)
+				if shards > 1:
+					query = Shard("id", shard, shards) & query if query else Shard("id", shard, shards)
+				mig.migrate(query)
+			finally:
+				api.log("Success", f"Record cache statistics: {api.records.get_stats()}")
+				if Barrier(f"{run_id}:{migration}", shards).arrive():
+					api.log("Success", f"Successfully migrated: {mig.en_doctype}")
+					scheduler = MigrationScheduler([MIGRATIONS_BY_NAME[name] for name in migrations])
+					if len(self._enqueue_ready(scheduler, run_id, shards, changed_only)) == len(migrations):
+						api.log("Success", "Migration finished")
+
+	@frappe.whitelist()
+	def check_wc_id_indexes(self, fix=False):
+		"""Reports the target DocTypes without a database index on wc_id and adds the missing indexes if fix is set."""
+		if cint(fix):
+			return ensure_wc_id_indexes()
+		return get_missing_wc_id_indexes()
 
 	@frappe.whitelist()
 	def clear_migrated_data(self):
-		"""Clears all migrated data from ERPNext."""
+		"""Clears the migrated data of the selected DocTypes from ERPNext."""
 		frappe.enqueue_doc(
 			"Weclapp Migration",
 			self.name,
@@ -106,8 +242,16 @@ class WeclappMigration(Document):
 		)
 
 	def clear_migrated_data_job(self):
+		"""Clears the selected migrations in reverse dependency order, so no document is deleted while others link to it.
+		Master data (see Migration.clearable) and DocTypes without the wc_id field are skipped."""
+		scheduler = self._get_scheduler()
 		with Api() as api:
-			customerMigration = CustomerMigration(api)
-			leadMigration = LeadMigration(api)
-			#customerMigration.clear_migrated()
-			leadMigration.clear_migrated()
+			for name in reversed(scheduler.get_order()):
+				migration = MIGRATIONS_BY_NAME[name](api)
+				if not migration.clearable or not frappe.db.has_column(migration.en_doctype, "wc_id"):
+					continue
+				try:
+					migration.clear_migrated()
+					api.log("Success", f"Cleared migrated data: {name}")
+				except Exception as e:
+					api.log("Error", f"Error while clearing {name}", f"{e}")
@@ -9,6 +9,23 @@ class WeclappMigrationSettings(Document):
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 		self.wc_page_size 		= 100
+		self.wc_workers			= 8
+		self.wc_use_projection	= True		# Fetch only the properties the migrations read
+		self.wc_job_timeout_margin	= 300	# Seconds before the job timeout to checkpoint and re-enqueue
+		self.wc_page_retries	= 3			# Refetches of a page whose response breaks off while reading
+		self.wc_download_workers	= 8
+		self.wc_download_queue_size	= 64
+		self.wc_download_chunk_size	= 1024 * 1024	# Bytes
+		self.wc_verify_blobs	= False		# Verify hashes of stored documents instead of sizes only
+		self.wc_request_timeout	= 120		# Seconds
+		self.wc_max_retries		= 8
+		self.wc_base_backoff	= 1.0		# Seconds
+		self.wc_max_backoff		= 60.0		# Seconds
+		self.wc_rate_limit		= 10.0		# Requests per second (start value, adapted at runtime)
+		self.wc_min_rate_limit	= 1.0
+		self.wc_max_rate_limit	= 50.0
+		self.wc_breaker_threshold	= 10	# Consecutive failures until the circuit opens
+		self.wc_breaker_timeout	= 30.0		# Seconds until a trial request is sent
 		self.wc_doctypes		= [
 			"accountingTransaction",
 			"article",
@@ -130,7 +147,33 @@ class WeclappMigrationSettings(Document):
 			"webhook",
 			"weclappOs"
 		]
-		self.wc_mail_doctypes	= [
+		self.wc_cache_indexes	= {	# Indexed fields of the cache per DocType (database and in-memory hash indexes)
+			"archivedEmail": ["entityName", "entityId"],
+			"party": ["customerNumber"],
+			"customer": ["id"],
+			"lead": ["id"],
+			"contact": ["id"]
+		}
+		self.wc_cache_backend	= "sqlite"	# Backend migrations read from: "sqlite" or "snapshot" (written after caching)
+		self.wc_snapshot_chunk_records	= 50000	# Entities per snapshot chunk
+		self.wc_snapshot_compress	= True	# Compress snapshot chunks with gzip (uncompressed chunks are memory mapped)
+		self.wc_cache_generations	= 0	# Completed cache runs kept as snapshot generations for "Migrate changed Data" (0 disables them)
+		self.wc_migration_shards	= 8	# Parallel jobs per DocType of a sharded migration (by hash of the WeClapp-ID)
+		self.wc_commit_batch_size	= 200	# Migrated records per commit (every record runs in its own savepoint)
+		self.wc_transaction_retries	= 3	# Retries of the uncommitted records after the database rolled back the transaction (deadlock)
+		self.wc_bulk_batch_size	= 500	# Records per multi-row insert of bulk migrations (flat master data)
+		self.wc_record_cache_mb	= 1024	# Memory budget of the in-memory record cache of a migration run
+		self.wc_compact_records	= True	# Keep only the properties read by the migrations in memory (compact records)
+		self.wc_bulk_attachments	= True	# Page documents and archived emails once per DocType
+		self.wc_skip_document_doctypes	= [	# DocTypes whose documents are not fetched
+			"accountingTransaction",
+			"translation",
+			"warehouseStock",
+			"warehouseStockMovement",
+			"webhook"
+		]
+		self.wc_email_batch_size	= 5000	# Archived emails written to the cache per transaction
+		self.wc_mail_doctypes	= [	# DocTypes whose archived emails are fetched
 			"salesInvoice",
 			"salesOrder",
 			"quotation",